@@ -0,0 +1,322 @@
+"""
+Benchmarks for the PNG codec and the image conversions of this folder.
+
+Synthetic images are generated for every combination of size, bit depth,
+color type and interlacing that is asked for, and each stage of the
+pipeline is timed on its own:
+
+encode     - png.Writer.write, rows to PNG bytes (also with each
+             --workers count of compression threads above 1)
+filter     - png.filter_scanline with the Paeth filter on every row
+compress   - zlib on the filtered scanlines
+decompress - zlib on the IDAT data
+unfilter   - png.Reader.undo_filter on the Paeth filtered scanlines
+decode     - png.Reader.read_flat, PNG bytes to pixels
+
+and, for 8-bit RGB images, the conversions of the image module
+(file2image, color2gray, gray2complex, image2bytes).  Stages that have
+both a pure-Python and a vectorized path are timed once per path, with
+the variant recorded in the results.
+
+The results are written as JSON, so that runs can be compared:
+
+    python bench.py -o new.json --baseline old.json
+
+reports (and exits with status 1 for) every stage that got slower than
+the baseline by more than --tolerance.
+"""
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import zlib
+from io import BytesIO
+
+import png
+import image
+
+# (greyscale, alpha) of each color type
+COLORS = {'L': (True, False), 'LA': (True, True),
+          'RGB': (False, False), 'RGBA': (False, True)}
+
+STAGES = ['encode', 'filter', 'compress', 'decompress', 'unfilter', 'decode',
+          'file2image', 'color2gray', 'gray2complex', 'image2bytes']
+
+
+def synthetic(width, height, planes, bitdepth):
+    """ Returns the rows (flat pixel format) of a test image: gradients
+        with some texture, so that it neither compresses to nothing nor
+        looks like noise. """
+    maxval = 2**bitdepth - 1
+    return [[((x*x + 3*x*y) >> 2 ^ (y + 17*p)) & maxval
+             for x in range(width) for p in range(planes)]
+            for y in range(height)]
+
+
+def best(f, repeat):
+    """ Runs f() `repeat` times and returns the fastest time in seconds
+        together with the result of the last call. """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def _scanlines(reader, data):
+    # Splits the decompressed data of a straightlaced image into
+    # (filter type, scanline) pairs
+    rowbytes = reader.row_bytes
+    step = rowbytes + 1
+    return [(data[i], data[i+1:i+step]) for i in range(0, len(data), step)]
+
+
+def _idat(png_bytes):
+    reader = png.Reader(bytes=png_bytes)
+    return b''.join(data for type, data in reader.chunks() if type == 'IDAT')
+
+
+def _variants():
+    # decode has a pure-Python and, with numpy installed, a vectorized
+    # Adam7 path
+    if png.numpy is None:
+        return [('python', None)]
+    return [('numpy', png.numpy), ('python', None)]
+
+
+def _gray2complex_python(gray, threshold=125):
+    # The loop gray2complex replaced, kept as the reference timing
+    return {i + j*1j for i, row in enumerate(gray)
+                      for j, v in enumerate(row) if v < threshold}
+
+
+def bench_image(width, height, color, bitdepth, interlace, stages, repeat,
+                workers=(1,)):
+    """ Times every stage in `stages` for one synthetic image and returns
+        a list of result records. """
+    greyscale, alpha = COLORS[color]
+    planes = len(color)
+    rows = synthetic(width, height, planes, bitdepth)
+    writer = png.Writer(width, height, greyscale=greyscale, alpha=alpha,
+                        bitdepth=bitdepth, interlace=interlace)
+    config = dict(width=width, height=height, color=color, bitdepth=bitdepth,
+                  interlace=interlace)
+    results = []
+
+    def record(stage, seconds, variant='default', **extra):
+        results.append(dict(config, stage=stage, variant=variant,
+                            seconds=seconds, **extra))
+
+    def encode():
+        f = BytesIO()
+        writer.write(f, rows)
+        return f.getvalue()
+    seconds, png_bytes = best(encode, repeat)
+    if 'encode' in stages:
+        record('encode', seconds, bytes=len(png_bytes))
+        for n in workers:
+            if n > 1:
+                parallel = png.Writer(width, height, greyscale=greyscale,
+                                      alpha=alpha, bitdepth=bitdepth,
+                                      interlace=interlace, workers=n)
+
+                def encode_parallel():
+                    f = BytesIO()
+                    parallel.write(f, rows)
+                    return f.getvalue()
+                seconds, data = best(encode_parallel, repeat)
+                record('encode', seconds, 'workers=%d' % n, bytes=len(data))
+
+    # The filter stages work on the byte scanlines of a straightlaced image
+    reader = png.Reader(bytes=png_bytes)
+    reader.preamble()
+    fo = max(1, int(reader.psize))
+    raw = zlib.decompress(_idat(png_bytes))
+    if not interlace:
+        lines = [line for type, line in _scanlines(reader, raw)]
+
+        def paeth():
+            prev = None
+            out = []
+            for line in lines:
+                out.append(png.filter_scanline(4, line, fo, prev))
+                prev = line
+            return b''.join(png.tostring(l) for l in out)
+        seconds, filtered = best(paeth, repeat)
+        if 'filter' in stages:
+            record('filter', seconds)
+        if 'compress' in stages:
+            seconds, _ = best(lambda: zlib.compress(filtered), repeat)
+            record('compress', seconds, bytes=len(filtered))
+        if 'unfilter' in stages:
+            pairs = _scanlines(reader, filtered)
+
+            def unfilter():
+                prev = None
+                for type, line in pairs:
+                    prev = reader.undo_filter(type, png.array('B', line), prev)
+            seconds, _ = best(unfilter, repeat)
+            record('unfilter', seconds)
+
+    if 'decompress' in stages:
+        idat = _idat(png_bytes)
+        seconds, _ = best(lambda: zlib.decompress(idat), repeat)
+        record('decompress', seconds, bytes=len(raw))
+
+    if 'decode' in stages:
+        saved = png.numpy
+        try:
+            for variant, module in _variants():
+                png.numpy = module
+                seconds, _ = best(
+                    lambda: png.Reader(bytes=png_bytes).read_flat(), repeat)
+                record('decode', seconds, variant)
+        finally:
+            png.numpy = saved
+
+    if color == 'RGB' and bitdepth == 8:
+        results.extend(dict(config, **r) for r in
+                       bench_conversions(png_bytes, stages, repeat))
+    return results
+
+
+def bench_conversions(png_bytes, stages, repeat):
+    """ Times the image module conversions on one 8-bit RGB PNG. """
+    results = []
+    fd, path = tempfile.mkstemp('.png')
+    try:
+        os.write(fd, png_bytes)
+        os.close(fd)
+        seconds, img = best(lambda: image.file2image(path), repeat)
+        if 'file2image' in stages:
+            results.append(dict(stage='file2image', variant='default',
+                                seconds=seconds))
+    finally:
+        os.remove(path)
+    seconds, gray = best(lambda: image.color2gray(img), repeat)
+    if 'color2gray' in stages:
+        results.append(dict(stage='color2gray', variant='default',
+                            seconds=seconds))
+    if 'gray2complex' in stages:
+        for variant, f in (('numpy', image.gray2complex),
+                           ('python', _gray2complex_python)):
+            seconds, _ = best(lambda: f(gray), repeat)
+            results.append(dict(stage='gray2complex', variant=variant,
+                                seconds=seconds))
+    if 'image2bytes' in stages:
+        seconds, _ = best(lambda: image.image2bytes(img), repeat)
+        results.append(dict(stage='image2bytes', variant='default',
+                            seconds=seconds))
+    return results
+
+
+def _key(r):
+    return (r['stage'], r['variant'], r['width'], r['height'], r['color'],
+            r['bitdepth'], r['interlace'])
+
+
+def compare(results, baseline, tolerance):
+    """ Returns the (record, baseline seconds) pairs of every result that
+        is more than `tolerance` (a fraction) slower than the matching
+        baseline record. """
+    old = {_key(r): r['seconds'] for r in baseline['results']}
+    return [(r, old[_key(r)]) for r in results
+            if _key(r) in old and r['seconds'] > old[_key(r)]*(1 + tolerance)]
+
+
+def _ints(option, opt, value, parser):
+    setattr(parser.values, option.dest, [int(v) for v in value.split(',')])
+
+
+def _strings(option, opt, value, parser):
+    setattr(parser.values, option.dest, value.split(','))
+
+
+def _main(argv):
+    """ Command line entry point: python bench.py [options] """
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.set_usage("python bench.py [options]")
+    parser.add_option("-s", "--sizes", default=[64, 256], type="string",
+                      action="callback", callback=_ints, metavar="n,n,...",
+                      help="image widths (images are square)")
+    parser.add_option("-b", "--bitdepths", default=[8, 16], type="string",
+                      action="callback", callback=_ints, metavar="n,n,...",
+                      help="bit depths; 1, 2 and 4 are only used for L")
+    parser.add_option("-c", "--colors", default=list(COLORS), type="string",
+                      action="callback", callback=_strings,
+                      metavar="L,LA,RGB,RGBA", help="color types")
+    parser.add_option("-i", "--interlace", default="both",
+                      type="choice", choices=["no", "yes", "both"],
+                      help="straightlaced, interlaced or both")
+    parser.add_option("--stages", default=STAGES, type="string",
+                      action="callback", callback=_strings,
+                      metavar="name,...", help="stages to time (default all)")
+    parser.add_option("-w", "--workers", default=[1], type="string",
+                      action="callback", callback=_ints, metavar="n,n,...",
+                      help="compression thread counts to time encode with")
+    parser.add_option("-r", "--repeat", default=3, type="int",
+                      help="runs per stage; the fastest is reported")
+    parser.add_option("-o", "--output", metavar="file",
+                      help="write the JSON results here instead of stdout")
+    parser.add_option("--baseline", metavar="file",
+                      help="JSON results of an earlier run to compare with")
+    parser.add_option("--tolerance", default=0.2, type="float",
+                      help="slowdown over the baseline that counts as a "
+                           "regression (default 0.2, i.e. 20%)")
+    (options, args) = parser.parse_args(args=argv[1:])
+    for color in options.colors:
+        if color not in COLORS:
+            parser.error("unknown color type %r" % color)
+    for stage in options.stages:
+        if stage not in STAGES:
+            parser.error("unknown stage %r" % stage)
+    interlaces = {'no': [False], 'yes': [True],
+                  'both': [False, True]}[options.interlace]
+
+    results = []
+    for size in options.sizes:
+        for color in options.colors:
+            for bitdepth in options.bitdepths:
+                if bitdepth < 8 and color != 'L':
+                    continue
+                for interlace in interlaces:
+                    results.extend(bench_image(size, size, color, bitdepth,
+                                               interlace, options.stages,
+                                               options.repeat,
+                                               options.workers))
+                    print("%4d x %-4d %-4s %2d-bit %s" %
+                          (size, size, color, bitdepth,
+                           ('straightlaced', 'interlaced')[interlace]),
+                          file=sys.stderr)
+
+    report = dict(python=platform.python_version(), cpus=os.cpu_count(),
+                  numpy=png.numpy and png.numpy.__version__,
+                  repeat=options.repeat, results=results)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        slower = compare(results, baseline, options.tolerance)
+        for r, old in slower:
+            print("slower: %s/%s %dx%d %s %d-bit%s: %.6fs -> %.6fs" %
+                  (r['stage'], r['variant'], r['width'], r['height'],
+                   r['color'], r['bitdepth'],
+                   ('', ' interlaced')[r['interlace']], old, r['seconds']),
+                  file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv))
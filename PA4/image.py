@@ -15,26 +15,29 @@ and display them with a web browser.
 
 import png
 import numbers
-import collections
+import collections.abc
+import functools
+import numpy as np
 
 # Native imports
 import webbrowser
 import tempfile
 import os
+import sys
+import time
 import atexit
-
-# Round color coordinate to nearest int and clamp to [0, 255]
-def _color_int(col):
-    return max(min(round(col), 255), 0)
+from io import BytesIO
 
 # utility conversions, between boxed pixel and flat pixel formats
 # the png library uses flat, we use boxed.
-def _boxed2flat(row):
-    return [_color_int(x) for box in row for x in box]
-
-def _flat2boxed(row):
-    # Note we skip every 4th element, thus eliminating the alpha channel
-    return [tuple(row[i:i+3]) for i in range(0, len(row), 4)]
+def _flat2boxed(row, planes=4):
+    # Groups the values into RGB tuples with strided slices; with 2 or 4
+    # planes every alpha value is skipped, with 1 or 2 the gray value is
+    # repeated
+    if planes >= 3:
+        return list(zip(row[0::planes], row[1::planes], row[2::planes]))
+    gray = row[0::planes] if planes == 2 else row
+    return list(zip(gray, gray, gray))
 
 ## Image conversions
 def isgray(image):
@@ -42,7 +45,7 @@ def isgray(image):
     col = image[0][0]
     if isinstance(col, numbers.Number):
         return True
-    elif isinstance(col, collections.Iterable) and len(col) == 3:
+    elif isinstance(col, collections.abc.Iterable) and len(col) == 3:
         return False
     else:
         raise TypeError('Unrecognized image type')
@@ -67,45 +70,128 @@ def rgpsplice(R,G,B):
     return [[(R[row][col],G[row][col],B[row][col]) for col in range(len(R[0]))] for row in range(len(R))]
 
 ## To and from files
-def file2image(path):
+def file2image(path, region=None):
     """ Reads an image into a list of lists of pixel values (tuples with
-        three values). This is a color image. """
-    (w, h, p, m) = png.Reader(filename = path).asRGBA() # force RGB and alpha
-    return [_flat2boxed(r) for r in p]
+        three values). This is a color image.  If `region` is given as a
+        (y0, y1, x0, x1) tuple, only rows y0 to y1 and columns x0 to x1
+        (excluding the ends, as with slices) are decoded. """
+    with png.Reader(filename = path) as reader:
+        reader.region = region
+        # Take the pixels in whatever direct format the file has (L, LA,
+        # RGB or RGBA) rather than forcing RGBA, which would synthesize an
+        # alpha channel only for _flat2boxed to drop it again
+        (w, h, p, m) = reader.asDirect()
+        return [_flat2boxed(r, m['planes']) for r in p]
+
 
+# Writers only depend on the image size, so one encoder per size is kept
+# around and reused for every image of that size.
+@functools.lru_cache(maxsize=8)
+def _writer(width, height):
+    return png.Writer(width=width, height=height)
+
+def _write(image, f):
+    pixels = np.asarray(image)
+    if pixels.dtype != np.uint8:
+        # Round to the nearest int and clamp to [0, 255] in one pass
+        pixels = np.clip(np.rint(pixels), 0, 255).astype(np.uint8)
+    if isgray(image):
+        pixels = np.repeat(pixels[..., np.newaxis], 3, axis=2)
+    pixels = np.ascontiguousarray(pixels)
+    _writer(len(image[0]), len(image)).write_buffer(f, pixels)
 
 def image2file(image, path):
     """ Writes an image in list of lists format to a file. Will work with
         either color or grayscale. """
-    if isgray(image):
-        img = gray2color(image)
-    else:
-        img = image
     with open(path, 'wb') as f:
-        png.Writer(width=len(image[0]), height=len(image)).write(f,
-            [_boxed2flat(r) for r in img])
-        
-def gray2complex(gray_img):
-    complex_pts = []
-    for i in range(len( gray_img)):
-        for j in range(len(gray_img[0])):
-            if gray_img[i][j] < 125:
-                complex_pts.append(i + j * 1j)
-    return set(complex_pts)
+        _write(image, f)
+
+def image2bytes(image):
+    """ Encodes an image in list of lists format as PNG and returns the
+        bytes, without touching the file system. """
+    f = BytesIO()
+    _write(image, f)
+    return f.getvalue()
+
+def images2files(images, directory, prefix='img'):
+    """ Writes each image of an iterable to directory/<prefix>NNNN.png and
+        returns the list of paths.  Images are encoded one at a time, so
+        only one image is held in memory. """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i, image in enumerate(images):
+        path = os.path.join(directory, '%s%04d.png' % (prefix, i))
+        image2file(image, path)
+        paths.append(path)
+    return paths
+
+
+def gray2complex(gray_img, threshold=125, stride=1, as_set=False):
+    """ Returns the dark pixels of a grayscale image as complex numbers
+        i + j*1j, where (i, j) is the (row, column) of each pixel whose
+        value is below `threshold`.  With `stride` > 1 only every
+        stride-th row and column is sampled, which downsamples the point
+        cloud while keeping the original pixel coordinates.  The result
+        is a complex128 numpy array, or a set if `as_set` is true. """
+    if stride < 1:
+        raise ValueError("stride must be a positive integer")
+    gray = np.asarray(gray_img)[::stride, ::stride]
+    rows, cols = np.nonzero(gray < threshold)
+    pts = np.empty(len(rows), dtype=np.complex128)
+    pts.real = rows * stride
+    pts.imag = cols * stride
+    if as_set:
+        return set(pts.tolist())
+    return pts
 
 
 ## Display functions
-def image2display(image, browser=None):
+def image2display(image, browser=None, block=True):
     """ Stores an image in a temporary location and displays it on screen
-        using a web browser. """
+        using a web browser.  If `block` is true, waits for Enter.
+
+        In headless mode (see setdisplaydir) the image is written to the
+        display directory instead, nothing is opened or waited for, and
+        the path of the written file is returned. """
+    if _display_dir is not None:
+        return _display_headless(image)
     path = _create_temp('.png')
     image2file(image, path)
     hpath = _create_temp('.html')
     with open(hpath, 'w') as h:
         h.writelines(["<html><body><img src='file://%s'/></body></html>" % path])
     openinbrowser('file://%s' % hpath, browser)
-    print("Hit Enter once the image is displayed.... ", end="")
-    input()
+    if block:
+        print("Hit Enter once the image is displayed.... ", end="")
+        input()
+    return path
+
+_display_dir = None
+_display_slots = 16
+_display_count = 0
+
+def setdisplaydir(path=None, slots=16):
+    """ Switches image2display to headless mode: images are written to
+        `path` as display00.png, display01.png, ... instead of being shown
+        in a browser.  File names are reused round-robin after `slots`
+        images, so the directory never holds more than `slots` files.
+        Calling with no argument restores browser display. """
+    global _display_dir, _display_slots, _display_count
+    if slots < 1:
+        raise ValueError("slots must be at least 1")
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+    _display_dir = path
+    _display_slots = slots
+    _display_count = 0
+
+def _display_headless(image):
+    global _display_count
+    path = os.path.join(_display_dir,
+                        'display%02d.png' % (_display_count % _display_slots))
+    _display_count += 1
+    image2file(image, path)
+    return path
 
 _browser = None
 
@@ -158,3 +244,156 @@ def _create_temp(suffix='', prefix='tmp', dir=None):
 # Register a file to be removed at exit
 def _remove_at_exit(path):
     atexit.register(os.remove, path)
+
+
+## Batch processing
+# Options of the batch job, set once in each worker process by _batch_init
+# so that tasks only carry file names.
+_batch_options = None
+
+def _batch_init(options):
+    global _batch_options
+    _batch_options = options
+
+def _error_message(e):
+    # png.Error already names its class in str()
+    message = str(e)
+    if message.startswith(type(e).__name__):
+        return message
+    return "%s: %s" % (type(e).__name__, message)
+
+def _batch_task(jobs):
+    """ Converts each (path, output path) pair in `jobs` according to
+        _batch_options and returns a list of (path, output path, seconds,
+        error), where error is None or the message of the exception that
+        stopped the conversion of that file. """
+    mode, threshold, stride = _batch_options
+    results = []
+    for path, out in jobs:
+        start = time.perf_counter()
+        try:
+            gray = color2gray(file2image(path))
+            if mode == 'gray':
+                image2file(gray, out)
+            else:
+                np.save(out, gray2complex(gray, threshold, stride))
+        except Exception as e:
+            results.append((path, out, time.perf_counter() - start,
+                            _error_message(e)))
+        else:
+            results.append((path, out, time.perf_counter() - start, None))
+    return results
+
+def _batch_files(args):
+    # Expand directories into the PNG files they contain.
+    for arg in args:
+        if os.path.isdir(arg):
+            for name in sorted(os.listdir(arg)):
+                if name.lower().endswith('.png'):
+                    yield os.path.join(arg, name)
+        else:
+            yield arg
+
+def _batch(argv):
+    """ Converts PNG files (or directories of them) in a pool of worker
+        processes.  Files are sent to the workers in chunks, and at most
+        --max-inflight chunks are pending at any time, so memory stays
+        bounded however many files there are.  A file that cannot be
+        converted is reported without stopping the others, and makes the
+        exit status 1. """
+    from optparse import OptionParser
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    parser = OptionParser()
+    parser.set_usage("python -m image batch [options] file-or-dir ...")
+    parser.add_option("-o", "--output", default=".", metavar="dir",
+                      help="directory for the converted files")
+    parser.add_option("-m", "--mode", default="gray",
+                      type="choice", choices=["gray", "complex"],
+                      help="gray: write grayscale PNGs; complex: save the "
+                           "dark pixels as complex points (.npy)")
+    parser.add_option("-t", "--threshold", default=125, type="int",
+                      help="gray value below which a pixel is a point")
+    parser.add_option("-s", "--stride", default=1, type="int",
+                      help="sample every n-th row and column")
+    parser.add_option("-j", "--workers", default=os.cpu_count(), type="int",
+                      metavar="n", help="number of worker processes")
+    parser.add_option("-c", "--chunksize", default=4, type="int",
+                      metavar="n", help="files per task")
+    parser.add_option("--max-inflight", type="int", metavar="n",
+                      help="tasks pending at once (default 2 per worker)")
+    (options, args) = parser.parse_args(args=argv)
+    if not args:
+        parser.error("no input files")
+    max_inflight = options.max_inflight or 2 * options.workers
+    os.makedirs(options.output, exist_ok=True)
+    ext = '.png' if options.mode == 'gray' else '.npy'
+    failed = []
+
+    def fail(path, error):
+        failed.append(path)
+        print("error: %s: %s" % (path, error), file=sys.stderr)
+
+    def report(futures):
+        for future in futures:
+            try:
+                results = future.result()
+            except Exception as e:
+                # the worker itself died; none of its files were converted
+                for path, out in pending.pop(future):
+                    fail(path, _error_message(e))
+                continue
+            del pending[future]
+            for path, out, seconds, error in results:
+                if error is None:
+                    print("%8.3fs  %s -> %s" % (seconds, path, out))
+                else:
+                    fail(path, error)
+
+    # Outputs are named after the input files; two inputs with the same
+    # name (a/x.png and b/x.png) would overwrite each other's output, so
+    # all but the first of them are rejected
+    outputs = {}
+    count = 0
+
+    def jobs():
+        nonlocal count
+        for path in _batch_files(args):
+            count += 1
+            name = os.path.splitext(os.path.basename(path))[0]
+            out = os.path.join(options.output, name + ext)
+            if out in outputs:
+                fail(path, "same output %s as %s" % (out, outputs[out]))
+            else:
+                outputs[out] = path
+                yield path, out
+
+    todo = jobs()
+    start = time.perf_counter()
+    initargs = ((options.mode, options.threshold, options.stride),)
+    with ProcessPoolExecutor(options.workers, initializer=_batch_init,
+                             initargs=initargs) as pool:
+        # future -> the jobs it carries
+        pending = {}
+        while True:
+            chunk = [job for _, job in zip(range(options.chunksize), todo)]
+            if not chunk:
+                break
+            if len(pending) >= max_inflight:
+                report(wait(pending, return_when=FIRST_COMPLETED)[0])
+            pending[pool.submit(_batch_task, chunk)] = chunk
+        report(wait(pending)[0])
+    print("%d files in %.3fs, %d failed" %
+          (count, time.perf_counter() - start, len(failed)))
+    return 1 if failed else 0
+
+def _main(argv):
+    """ Command line entry point: python -m image batch [options] ... """
+    if len(argv) < 2 or argv[1] != 'batch':
+        print("usage: python -m image batch [options] file-or-dir ...")
+        print("       python -m image batch --help for the options")
+        return 2
+    return _batch(argv[2:])
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv))
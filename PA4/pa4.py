@@ -1,4 +1,5 @@
-import math
+import cmath
+import numpy as np
 
 """ ----------------- PROBLEM 1 ----------------- """
 def translate(S, z0):
@@ -10,6 +11,8 @@ def translate(S, z0):
 	OUT:
 		* a set consisting of points in S translated by z0
 	"""
+	if isinstance(S, PointSet):
+		return S.translate(z0)
 	return {p + z0 for p in S}
 
 
@@ -26,6 +29,8 @@ def scale(S, k):
 	"""
 	if k <= 0:
 		raise ValueError
+	if isinstance(S, PointSet):
+		return S.scale(k)
 	return {p * k for p in S}
 
 
@@ -42,7 +47,178 @@ def rotate(S, tau):
 		* a set consisting of points in S rotated by tau radians
 		
 	"""
-	return {(p * math.e**(tau * 1j)) for p in S}
+	if isinstance(S, PointSet):
+		return S.rotate(tau)
+	r = cmath.exp(tau * 1j)
+	return {p * r for p in S}
+
+
+class PointSet:
+	"""
+	A set of complex numbers stored in a complex128 numpy array, so that
+	translate, scale and rotate act on all points in one vectorized pass.
+	Duplicate points are kept unless `unique` is true or unique() is called.
+	"""
+
+	def __init__(self, points=(), unique=False):
+		"""
+		INPUT:
+			* points - iterable of complex numbers (set, list or array)
+			* unique - bool, drop duplicate points on construction
+		"""
+		if isinstance(points, (set, frozenset)):
+			points = list(points)
+		self.points = np.array(points, dtype=np.complex128).ravel()
+		if unique:
+			self.points = np.unique(self.points)
+
+	def transform(self, a, b=0, inplace=False):
+		"""
+		applies the affine map z -> a*z + b to every point
+		INPUT:
+			* a - complex multiplier
+			* b - complex offset
+			* inplace - bool, overwrite this PointSet instead of returning a new one
+		OUT:
+			* the transformed PointSet
+		"""
+		if inplace:
+			pts = self.points
+			if a != 1:
+				np.multiply(pts, a, out=pts)
+			if b != 0:
+				np.add(pts, b, out=pts)
+			return self
+		T = PointSet.__new__(PointSet)
+		T.points = self.points * a + b if a != 1 else self.points + b
+		return T
+
+	def translate(self, z0, inplace=False):
+		"""translates the points by z0"""
+		return self.transform(1, z0, inplace)
+
+	def scale(self, k, inplace=False):
+		"""scales the points by k; raises ValueError if k <= 0"""
+		if k <= 0:
+			raise ValueError
+		return self.transform(k, 0, inplace)
+
+	def rotate(self, tau, inplace=False):
+		"""rotates the points by tau radians (counterclockwise if positive)"""
+		return self.transform(cmath.exp(tau * 1j), 0, inplace)
+
+	def unique(self):
+		"""returns a PointSet with duplicate points removed"""
+		return PointSet(self.points, unique=True)
+
+	def to_set(self):
+		"""returns the points as a Python set of complex numbers"""
+		return set(self.points.tolist())
+
+	def __len__(self):
+		return len(self.points)
+
+	def __iter__(self):
+		return iter(self.points.tolist())
+
+	def __contains__(self, z):
+		return bool(np.any(self.points == z))
+
+	def __eq__(self, other):
+		"""compares as sets, so order and duplicates are ignored"""
+		if isinstance(other, PointSet):
+			other = other.to_set()
+		return self.to_set() == other
+
+	def __str__(self):
+		return str(self.points.tolist())
+
+
+class TransformChain:
+	"""
+	Records translate/scale/rotate steps without touching any points and
+	folds them into a single affine map z -> a*z + b.  The points are only
+	visited once, when the chain is applied (or streamed chunk by chunk).
+
+		T = TransformChain().translate(-3 - 2j).rotate(cmath.pi / 2).scale(2)
+		S2 = T.apply(S)
+	"""
+
+	def __init__(self):
+		self.steps = []
+		self.a = 1
+		self.b = 0
+
+	def transform(self, a, b=0):
+		"""appends the affine step z -> a*z + b; returns the chain"""
+		self.steps.append(('transform', a, b))
+		self.a, self.b = a * self.a, a * self.b + b
+		return self
+
+	def translate(self, z0):
+		"""appends a translation by z0; returns the chain"""
+		self.steps.append(('translate', z0))
+		self.b = self.b + z0
+		return self
+
+	def scale(self, k):
+		"""appends a scaling by k; raises ValueError if k <= 0"""
+		if k <= 0:
+			raise ValueError
+		self.steps.append(('scale', k))
+		self.a, self.b = k * self.a, k * self.b
+		return self
+
+	def rotate(self, tau):
+		"""appends a rotation by tau radians; returns the chain"""
+		self.steps.append(('rotate', tau))
+		r = cmath.exp(tau * 1j)
+		self.a, self.b = r * self.a, r * self.b
+		return self
+
+	def coefficients(self):
+		"""returns the folded (multiplier, offset) pair"""
+		return self.a, self.b
+
+	def apply(self, S, inplace=False):
+		"""
+		applies the whole chain in a single pass
+		INPUT:
+			* S - set of complex numbers, PointSet or numpy array
+			* inplace - bool, only honoured for PointSet inputs
+		OUT:
+			* points of the same type as S
+		"""
+		a, b = self.a, self.b
+		if isinstance(S, PointSet):
+			return S.transform(a, b, inplace)
+		if isinstance(S, np.ndarray):
+			return S * a + b
+		return {a * p + b for p in S}
+
+	def stream(self, points, chunk_size=65536):
+		"""
+		generator yielding the transformed points as complex128 arrays of at
+		most chunk_size elements; points may be any iterable or array
+		"""
+		a, b = self.a, self.b
+		if isinstance(points, PointSet):
+			points = points.points
+		if isinstance(points, np.ndarray):
+			for i in range(0, len(points), chunk_size):
+				yield points[i:i + chunk_size] * a + b
+			return
+		chunk = []
+		for p in points:
+			chunk.append(p)
+			if len(chunk) == chunk_size:
+				yield np.array(chunk, dtype=np.complex128) * a + b
+				chunk = []
+		if chunk:
+			yield np.array(chunk, dtype=np.complex128) * a + b
+
+	def __len__(self):
+		return len(self.steps)
 
 
 """ ----------------- PROBLEM 4 ----------------- """
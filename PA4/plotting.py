@@ -1,46 +1,106 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import itertools
 import time
 
 
-def plot(sets, colors=[], time = 10):
-  # extract real part
+def _as_points(S):
+  # complex128 array view of a set, list, PointSet or array of points
+  if hasattr(S, 'points'):
+    S = S.points
+  if isinstance(S, np.ndarray):
+    return S.astype(np.complex128, copy=False).ravel()
+  return np.fromiter(S, dtype=np.complex128, count=len(S))
+
+
+def _reduce(pts, max_points, density, bins, extent):
+  # keep at most max_points points: either every k-th point, or the
+  # centers of the occupied cells of a bins x bins grid over the plot area,
+  # with the grid made coarser until no more than max_points cells are used
+  if not density:
+    return pts[::-(-len(pts) // max_points)]
+  x_min, x_max, y_min, y_max = extent
+  while True:
+    counts, xedges, yedges = np.histogram2d(pts.real, pts.imag, bins=bins,
+                                            range=[[x_min, max(x_max, x_min + 1)],
+                                                   [y_min, max(y_max, y_min + 1)]])
+    if np.count_nonzero(counts) <= max_points or bins == 1:
+      break
+    bins //= 2
+  i, j = np.nonzero(counts)
+  xc = (xedges[i] + xedges[i + 1]) / 2
+  yc = (yedges[j] + yedges[j + 1]) / 2
+  return xc + 1j * yc
+
+
+def plot(sets, colors=[], time = 10, output=None, max_points=None,
+         density=False, bins=512):
+  """
+  Scatter plots each set of complex numbers in the complex plane.
+
+  output     - if given, the plot is rendered off-screen (Agg) straight to
+               this PNG path and the function returns without displaying
+               or sleeping
+  max_points - sets with more points than this (at least 1) are reduced to
+               at most max_points before drawing: decimated by a fixed
+               stride, or, with density=True, rasterized onto the
+               occupied cells of a grid of at most bins x bins cells
+  time       - seconds the interactive window stays open; 0 returns
+               immediately and leaves the window open
+  """
+  if max_points is not None and max_points < 1:
+    raise ValueError("max_points must be at least 1")
   if colors == []:
     colors = itertools.cycle(["r", "b", "g"])
   else:
     colors = itertools.cycle(colors)
-  i = 0
-  x_min = min([z.real for z in sets[0]])
-  x_max = max([z.real for z in sets[0]])
-  y_min = min([z.imag for z in sets[0]])
-  y_max = max([z.imag for z in sets[0]])
-  for S in sets:
-    x = [ele.real for ele in S]
-    # extract imaginary part
-    y = [ele.imag for ele in S]
-
-    x_min = min([min(x), x_min])
-    x_max = max([max(x), x_max])
-    y_min = min([min(y), y_min])
-    y_max = max([max(y), y_max])
-
-    # plot the complex numbers
-    plt.scatter(x, y, color=next(colors))
-    i += 1
-  plt.ylabel('Imaginary')
-  plt.xlabel('Real')
-  plt.xlim(x_min - 2, x_max + 2)
-  plt.ylim(y_min - 2, y_max + 2)
-  plt.axvline(x=0, c="black", label="Real axis")
-  plt.axhline(y=0, c="black", label="Imaginary axis")
+  pts = [_as_points(S) for S in sets]
+  nonempty = [p for p in pts if len(p)]
+  if nonempty:
+    x_min = min(p.real.min() for p in nonempty)
+    x_max = max(p.real.max() for p in nonempty)
+    y_min = min(p.imag.min() for p in nonempty)
+    y_max = max(p.imag.max() for p in nonempty)
+  else:
+    x_min = x_max = y_min = y_max = 0
+
+  if output is None:
+    ax = plt.gca()
+  else:
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+  for p in pts:
+    color = next(colors)
+    if max_points is not None and len(p) > max_points:
+      p = _reduce(p, max_points, density, bins, (x_min, x_max, y_min, y_max))
+      ax.scatter(p.real, p.imag, color=color, s=1, rasterized=True)
+    else:
+      # plot the complex numbers
+      ax.scatter(p.real, p.imag, color=color)
+  ax.set_ylabel('Imaginary')
+  ax.set_xlabel('Real')
+  ax.set_xlim(x_min - 2, x_max + 2)
+  ax.set_ylim(y_min - 2, y_max + 2)
+  ax.axvline(x=0, c="black", label="Real axis")
+  ax.axhline(y=0, c="black", label="Imaginary axis")
+
+  if output is not None:
+    fig.savefig(output, format='png')
+    return output
+
   plt.ion()
   plt.show()
+  if time <= 0:
+    return
 
   print(f"Plot is on display. Closing plot in {time} seconds...")
   for remaining in range(time, 0, -1):
-      print(f"{remaining}", end= ' ') 
+      print(f"{remaining}", end= ' ')
       plt.pause(1)
   plt.close()
-  
+
@@ -168,12 +168,14 @@ And now, my famous members
 __version__ = "$URL$ $Rev$"
 
 from array import array
+from collections import deque
 from functools import reduce
 try: # See :pyver:old
     import itertools
 except:
     pass
 import math
+import mmap
 # http://www.python.org/doc/2.4.4/lib/module-operator.html
 import operator
 import struct
@@ -181,6 +183,11 @@ import sys
 import zlib
 # http://www.python.org/doc/2.4.4/lib/module-warnings.html
 import warnings
+# numpy is optional; when present it is used to speed up some operations.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 __all__ = ['Image', 'Reader', 'Writer', 'write_chunks', 'from_array']
 
@@ -216,6 +223,12 @@ try:  # see :pyver:old
     array.tostring
 except:
     def tostring(row):
+        """Convert row of bytes to string.  A byte ``array`` is copied
+        in one go; packing it value by value made this the slowest
+        serial step of writing an image.
+        """
+        if isinstance(row, array) and row.typecode == 'B':
+            return row.tobytes()
         l = len(row)
         return struct.pack('%dB' % l, *row)
 else:
@@ -263,6 +276,33 @@ def interleave_planes(ipixels, apixels, ipsize, apsize):
         out[i+ipsize:newtotal:newpsize] = apixels[i:atotal:apsize]
     return out
 
+# Lookup tables for unpacking bit depths < 8, indexed by bit depth.  Each
+# table maps a byte to the string of its samples, most significant first.
+_unpack_tables = {}
+
+def _unpack_table(bitdepth):
+    """Return the 256 entry table that unpacks a byte holding samples of
+    `bitdepth` bits (1, 2, or 4) into one byte per sample.
+    """
+
+    table = _unpack_tables.get(bitdepth)
+    if table is None:
+        mask = 2**bitdepth - 1
+        shifts = list(range(8 - bitdepth, -1, -bitdepth))
+        table = [bytes([(o >> s) & mask for s in shifts]) for o in range(256)]
+        _unpack_tables[bitdepth] = table
+    return table
+
+def _unpack16(raw):
+    """Convert a sequence of bytes holding big-endian 16-bit samples into
+    an ``array('H')``.
+    """
+
+    a = array('H', bytes(raw))
+    if sys.byteorder == 'little':
+        a.byteswap()
+    return a
+
 def check_palette(palette):
     """Check a palette argument (to the :class:`Writer` class) for validity.
     Returns the palette as a list if okay; raises an exception otherwise.
@@ -327,7 +367,8 @@ class Writer:
                  planes=None,
                  colormap=None,
                  maxval=None,
-                 chunk_limit=2**20):
+                 chunk_limit=2**20,
+                 workers=None):
         """
         Create a PNG encoder object.
 
@@ -357,6 +398,8 @@ class Writer:
           Create an interlaced image.
         chunk_limit
           Write multiple ``IDAT`` chunks to save memory.
+        workers
+          Compress the image data in this many threads.
 
         The image size (in pixels) can be specified either by using the
         `width` and `height` arguments, or with the single `size`
@@ -444,6 +487,12 @@ class Writer:
         `chunk_limit` is used to limit the amount of memory used whilst
         compressing the image.  In order to avoid using large amounts of
         memory, multiple ``IDAT`` chunks may be created.
+
+        If `workers` is greater than 1 the image data is cut into bands
+        of at most 256K (or `chunk_limit` bytes, if that is smaller)
+        which are compressed in parallel by a pool of that many threads
+        (zlib releases the GIL whilst it compresses).  The bands are stitched into a single valid zlib
+        stream, so the resulting file is an ordinary PNG file.
         """
 
         # At the moment the `planes` argument is ignored;
@@ -587,6 +636,7 @@ class Writer:
         self.bitdepth = int(bitdepth)
         self.compression = compression
         self.chunk_limit = chunk_limit
+        self.workers = int(workers or 1)
         self.interlace = bool(interlace)
         self.palette = check_palette(palette)
 
@@ -662,6 +712,27 @@ class Writer:
 
         """
 
+        # http://www.w3.org/TR/PNG/#11IDAT
+        if self.workers > 1:
+            compressor = _ParallelCompressor(self.compression, self.workers)
+            try:
+                return self._write_passes(outfile, rows, packed, compressor,
+                  min(self.chunk_limit, _PARALLEL_BAND))
+            finally:
+                # also when writing fails half way
+                compressor.close()
+        if self.compression is not None:
+            compressor = zlib.compressobj(self.compression)
+        else:
+            compressor = zlib.compressobj()
+        return self._write_passes(outfile, rows, packed, compressor,
+          self.chunk_limit)
+
+    def _write_passes(self, outfile, rows, packed, compressor, limit):
+        """Implements :meth:`write_passes`; the image data is compressed
+        with `compressor` in pieces of about `limit` bytes.
+        """
+
         # http://www.w3.org/TR/PNG/#5PNG-file-signature
         outfile.write(_signature)
 
@@ -714,17 +785,19 @@ class Writer:
                 write_chunk(outfile, 'bKGD',
                             struct.pack("!3H", *self.background))
 
-        # http://www.w3.org/TR/PNG/#11IDAT
-        if self.compression is not None:
-            compressor = zlib.compressobj(self.compression)
-        else:
-            compressor = zlib.compressobj()
-
         # Choose an extend function based on the bitdepth.  The extend
         # function packs/decomposes the pixel values into bytes and
         # stuffs them onto the data array.
         data = array('B')
-        if self.bitdepth == 8 or packed:
+        if packed:
+            # Packed rows that support the buffer protocol (bytes,
+            # memoryview, array('B')) are copied in one go.
+            def extend(sl):
+                try:
+                    data.frombytes(sl)
+                except TypeError:
+                    data.extend(sl)
+        elif self.bitdepth == 8:
             extend = data.extend
         elif self.bitdepth == 16:
             # Decompose into bytes
@@ -791,7 +864,7 @@ class Writer:
             # we used "up", "average", or "paeth" on such a line.
             data.append(0)
             extend(row)
-            if len(data) > self.chunk_limit:
+            if len(data) > limit:
                 compressed = compressor.compress(tostring(data))
                 if len(compressed):
                     # print >> sys.stderr, len(data), len(compressed)
@@ -804,7 +877,7 @@ class Writer:
         if len(data):
             compressed = compressor.compress(tostring(data))
         else:
-            compressed = ''
+            compressed = strtobytes('')
         flushed = compressor.flush()
         if len(compressed) or len(flushed):
             # print >> sys.stderr, len(data), len(compressed), len(flushed)
@@ -844,6 +917,47 @@ class Writer:
               self.rescale[0])
         return self.write_passes(outfile, rows, packed=True)
 
+    def write_buffer(self, outfile, buffer, stride=None):
+        """
+        Write PNG file to `outfile`.  The pixel data comes from
+        `buffer`, a single contiguous object supporting the buffer
+        protocol (``bytes``, ``bytearray``, ``memoryview``, a
+        C-contiguous NumPy array, ...) that holds the rows in packed
+        format, one after the other.
+
+        `stride` is the distance in bytes between the starts of
+        successive rows; it defaults to the packed row length, and may
+        be larger when the rows are padded.  Each scanline is a slice of
+        a ``memoryview`` of `buffer`, so no per-pixel work is done in
+        Python.
+
+        Interlaced images are only supported at bit depth 8.
+        """
+
+        if self.rescale:
+            raise Error("write_buffer method not suitable for bit depth %d" %
+              self.rescale[0])
+        view = memoryview(buffer).cast('B')
+        rowbytes = (self.width * self.planes * self.bitdepth + 7) // 8
+        if stride is None:
+            stride = rowbytes
+        if stride < rowbytes:
+            raise ValueError("stride (%d) is less than the row length (%d)" %
+              (stride, rowbytes))
+        if len(view) < stride * (self.height - 1) + rowbytes:
+            raise ValueError("buffer of %d bytes is too short for %d rows" %
+              (len(view), self.height))
+        rows = (view[i:i+rowbytes]
+                for i in range(0, stride * self.height, stride))
+        if self.interlace:
+            if self.bitdepth != 8:
+                raise Error("write_buffer can only interlace at bit depth 8")
+            pixels = array('B')
+            for row in rows:
+                pixels.frombytes(row)
+            return self.write_array(outfile, pixels)
+        return self.write_passes(outfile, rows, packed=True)
+
     def convert_pnm(self, infile, outfile):
         """
         Convert a PNM file containing raw pixel data into a PNG file
@@ -973,6 +1087,101 @@ def write_chunk(outfile, tag, data=strtobytes('')):
     checksum &= 2**32-1
     outfile.write(struct.pack("!I", checksum))
 
+def _adler32_combine(adler1, adler2, len2):
+    """Return the Adler-32 checksum of the concatenation of two strings,
+    given the checksum of each and the length of the second.  This is
+    ``adler32_combine`` from zlib, which Python does not expose.
+    """
+
+    BASE = 65521
+    rem = len2 % BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % BASE
+    sum1 += (adler2 & 0xffff) + BASE - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + BASE - rem
+    return (sum1 % BASE) | ((sum2 % BASE) << 16)
+
+def _deflate_band(data, level, zdict, last):
+    """Compress one band as raw deflate data.  The band ends on a byte
+    boundary (sync flush) unless it is the `last` one, which terminates
+    the deflate stream.  Returns (*compressed*, *adler32*, *length*).
+    """
+
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15,
+                                      zlib.DEF_MEM_LEVEL,
+                                      zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    flush = (zlib.Z_SYNC_FLUSH, zlib.Z_FINISH)[bool(last)]
+    compressed = compressor.compress(data) + compressor.flush(flush)
+    return compressed, zlib.adler32(data), len(data)
+
+# Band size of the parallel compressor.  Small enough that an image of a
+# few megabytes keeps several threads busy, large enough that the 32K
+# dictionary priming each band costs next to nothing.
+_PARALLEL_BAND = 2**18
+
+class _ParallelCompressor:
+    """
+    Drop-in replacement for a ``zlib.compressobj`` that compresses each
+    string passed to :meth:`compress` as an independent band in a thread
+    pool, in the manner of pigz.  Every band is primed with the last 32K
+    of the previous band as its dictionary, so compression hardly suffers.
+    The bands are sync flushed raw deflate data, so they concatenate
+    into one deflate stream; the zlib header is written in front and the
+    Adler-32 checksum, combined from the checksums of the bands, after.
+    At most ``2*workers`` bands are in flight at once.
+    """
+
+    def __init__(self, level=None, workers=2):
+        from concurrent.futures import ThreadPoolExecutor
+
+        if level is None:
+            level = -1
+        self.level = level
+        self.pool = ThreadPoolExecutor(workers)
+        self.limit = 2 * workers
+        self.pending = deque()
+        self.zdict = strtobytes('')
+        self.adler = 1
+        # zlib header: deflate, 32K window, default level (check bits ok).
+        self.header = strtobytes('\x78\x9c')
+
+    def _submit(self, data, last):
+        self.pending.append(self.pool.submit(
+            _deflate_band, data, self.level, self.zdict, last))
+        self.zdict = data[-32768:]
+
+    def _collect(self):
+        compressed, adler, length = self.pending.popleft().result()
+        self.adler = _adler32_combine(self.adler, adler, length)
+        return compressed
+
+    def compress(self, data):
+        out = [self.header]
+        self.header = strtobytes('')
+        self._submit(data, False)
+        while len(self.pending) > self.limit:
+            out.append(self._collect())
+        return strtobytes('').join(out)
+
+    def flush(self):
+        out = [self.header]
+        self._submit(strtobytes(''), True)
+        while self.pending:
+            out.append(self._collect())
+        self.pool.shutdown()
+        out.append(struct.pack('!I', self.adler))
+        return strtobytes('').join(out)
+
+    def close(self):
+        """Stop the threads, dropping bands that have not been
+        compressed yet.  Called after :meth:`flush` it does nothing.
+        """
+
+        self.pool.shutdown(cancel_futures=True)
+
 def write_chunks(out, chunks):
     """Create a PNG file by writing out the chunks."""
 
@@ -1316,6 +1525,44 @@ class _readable:
         self.offset += n
         return r
 
+class _mapped:
+    """
+    A file-like interface for a memory mapped file.  :meth:`read`
+    returns copies, like a file does, but :attr:`view` gives zero-copy
+    access to the whole file.
+    """
+
+    def __init__(self, filename):
+        f = open(filename, 'rb')
+        try:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file cannot be mapped.
+                self.map = strtobytes('')
+        finally:
+            f.close()
+        self.view = memoryview(self.map)
+        self.offset = 0
+
+    def read(self, n):
+        r = self.map[self.offset:self.offset+n]
+        self.offset += len(r)
+        return r
+
+    def close(self):
+        """Unmap the file.  If views of the map are still in use (rows
+        of a read that was not finished), it is unmapped when the last
+        of them is dropped instead.
+        """
+        self.view.release()
+        try:
+            self.map.close()
+        except (AttributeError, BufferError):
+            pass
+        self.map = strtobytes('')
+        self.view = memoryview(self.map)
+
 
 class Reader:
     """
@@ -1326,7 +1573,8 @@ class Reader:
         """
         Create a PNG decoder object.
 
-        The constructor expects exactly one keyword argument. If you
+        The constructor expects exactly one keyword argument for the
+        input (plus the optional `crc` argument). If you
         supply a positional argument instead, it will guess the input
         type. You can choose among the following keyword arguments:
 
@@ -1336,12 +1584,52 @@ class Reader:
           A file-like object (object with a read() method).
         bytes
           ``array`` or ``string`` with PNG data.
-
+        mmap
+          Name of input file, which is memory mapped instead of read.
+          Chunk data is then accessed in place; see :meth:`chunk_index`.
+
+        The `crc` argument controls checksum validation of chunks:
+
+        ``'check'``
+          (the default) every chunk is checked as it is read.
+        ``'skip'``
+          no chunk is checked; for trusted, locally generated files.
+        ``'defer'``
+          checksum errors are reported together once the pixels have
+          been decoded, instead of stopping the read part way.  Only
+          the checksums are kept, not the chunk data; with `mmap` the
+          ``IDAT`` chunks are checked in place at the end.  A region
+          read (see :meth:`read_region`) stops reading the file after
+          its last row, so from a file that is not memory mapped only
+          the chunks up to there are checked.
+        ``'sample'``
+          chunks other than ``IDAT`` are checked, and one in every
+          :attr:`crc_sample` ``IDAT`` chunks.
+
+        The whole file can be checked separately with :meth:`validate`.
+
+        A file the Reader opens itself (`filename` and `mmap`) stays open
+        until :meth:`close` is called; Readers are also context managers
+        that close on exit::
+
+            with Reader(mmap=name) as r:
+                x, y, pixels, meta = r.read_flat()
         """
+        crc = kw.pop('crc', 'check')
+        if crc not in ('check', 'skip', 'defer', 'sample'):
+            raise ValueError("crc must be 'check', 'skip', 'defer', or 'sample'")
         if ((_guess is not None and len(kw) != 0) or
             (_guess is None and len(kw) != 1)):
             raise TypeError("Reader() takes exactly 1 argument")
 
+        self.crc = crc
+        # With crc='sample', one in this many IDAT chunks is checked.
+        self.crc_sample = 8
+        self.idat_count = 0
+        # (type, checksum, computed checksum) of the chunks that failed
+        # and are waiting to be reported, when crc='defer'.
+        self.deferred = []
+
         # Will be the first 8 bytes, later on.  See validate_signature.
         self.signature = None
         self.transparent = None
@@ -1350,6 +1638,12 @@ class Reader:
         # past the 4 bytes that specify the chunk type).  See preamble
         # method for how this is used.
         self.atchunk = None
+        # List of (type, offset, length) for each chunk; built on demand
+        # by chunk_index for memory mapped files.
+        self.index = None
+        # (y0, y1, x0, x1) when only part of the image should be
+        # decoded; see read_region.
+        self.region = None
 
         if _guess is not None:
             if isarray(_guess):
@@ -1359,15 +1653,34 @@ class Reader:
             elif isinstance(_guess, file):
                 kw["file"] = _guess
 
+        # Files passed in with `file` belong to the caller.
+        self.owns_file = "filename" in kw or "mmap" in kw
         if "filename" in kw:
             self.file = open(kw["filename"], "rb")
         elif "file" in kw:
             self.file = kw["file"]
         elif "bytes" in kw:
             self.file = _readable(kw["bytes"])
+        elif "mmap" in kw:
+            self.file = _mapped(kw["mmap"])
         else:
-            raise TypeError("expecting filename, file or bytes array")
+            raise TypeError("expecting filename, file, bytes array, or mmap")
 
+    def close(self):
+        """
+        Close the input file (or memory map), if the Reader opened it.
+        A file passed in with the `file` argument is left open.
+        """
+
+        if self.owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
 
     def chunk(self, seek=None, lenient=False):
         """
@@ -1403,26 +1716,156 @@ class Reader:
                 raise ValueError('Chunk %s too short for checksum.', tag)
             if seek and type != seek:
                 continue
-            verify = zlib.crc32(strtobytes(type))
-            verify = zlib.crc32(data, verify)
-            # Whether the output from zlib.crc32 is signed or not varies
-            # according to hideous implementation details, see
-            # http://bugs.python.org/issue1202 .
-            # We coerce it to be positive here (in a way which works on
-            # Python 2.3 and older).
-            verify &= 2**32 - 1
-            verify = struct.pack('!I', verify)
-            if checksum != verify:
-                # print repr(checksum)
-                (a, ) = struct.unpack('!I', checksum)
-                (b, ) = struct.unpack('!I', verify)
-                message = "Checksum error in %s chunk: 0x%08X != 0x%08X." % (type, a, b)
-                if lenient:
-                    warnings.warn(message, RuntimeWarning)
-                else:
-                    raise ChunkError(message)
+            (checksum, ) = struct.unpack('!I', checksum)
+            self._check_crc(type, data, checksum, lenient)
+            if type == 'IEND':
+                self._check_deferred(lenient)
             return type, data
 
+    def _crc(self, type, data):
+        """Return the CRC of a chunk's type and data, as an unsigned int."""
+
+        verify = zlib.crc32(strtobytes(type))
+        verify = zlib.crc32(data, verify)
+        # Whether the output from zlib.crc32 is signed or not varies
+        # according to hideous implementation details, see
+        # http://bugs.python.org/issue1202 .
+        # We coerce it to be positive here (in a way which works on
+        # Python 2.3 and older).
+        return verify & (2**32 - 1)
+
+    def _check_crc(self, type, data, checksum, lenient):
+        """Check (or skip, or defer checking) a chunk's `checksum`,
+        according to the `crc` mode of this reader.
+        """
+
+        if self.crc == 'skip':
+            return
+        if self.crc == 'defer':
+            verify = self._crc(type, data)
+            if checksum != verify:
+                self.deferred.append((type, checksum, verify))
+            return
+        if self.crc == 'sample' and type == 'IDAT':
+            self.idat_count += 1
+            if (self.idat_count - 1) % self.crc_sample:
+                return
+        verify = self._crc(type, data)
+        if checksum != verify:
+            self._checksum_error(type, checksum, verify, lenient)
+
+    def _check_deferred(self, lenient):
+        """Report the chunks whose checks were deferred and failed."""
+
+        deferred, self.deferred = self.deferred, []
+        for type, checksum, verify in deferred:
+            self._checksum_error(type, checksum, verify, lenient)
+
+    def _check_after(self, pixels, lenient):
+        """Iterator that yields the rows of `pixels` and then does the
+        deferred checks, those of the ``IDAT`` chunks of a memory mapped
+        file included.
+        """
+
+        for row in pixels:
+            yield row
+        if isinstance(self.file, _mapped):
+            view = self.file.view
+            for type, offset, length in self.chunk_index():
+                if type != 'IDAT':
+                    continue
+                verify = zlib.crc32(view[offset-4:offset+length]) & (2**32-1)
+                (checksum, ) = struct.unpack_from('!I', view, offset+length)
+                if checksum != verify:
+                    self.deferred.append((type, checksum, verify))
+        self._check_deferred(lenient)
+
+    def validate(self):
+        """Check the checksum of every chunk in the file in a single
+        pass, whatever the `crc` mode of this reader.  Returns a list of
+        (*type*, *offset*) pairs, one for each chunk that fails, where
+        *offset* is the file offset of the chunk's data; an empty list
+        means the file is intact.
+
+        With a memory mapped file (the `mmap` argument) the checksums
+        are computed in place from the map and the reader can still be
+        used afterwards.  Otherwise the chunks are read from the input,
+        which is then used up.
+        """
+
+        bad = []
+        if isinstance(self.file, _mapped):
+            view = self.file.view
+            for type, offset, length in self.chunk_index():
+                # The checksum covers the type and the data.
+                verify = zlib.crc32(view[offset-4:offset+length]) & (2**32-1)
+                (checksum, ) = struct.unpack_from('!I', view, offset+length)
+                if checksum != verify:
+                    bad.append((type, offset))
+            return bad
+        self.validate_signature()
+        offset = 8
+        while True:
+            x = self.chunklentype()
+            if x is None:
+                break
+            length, type = x
+            data = self.file.read(length)
+            checksum = self.file.read(4)
+            if len(data) != length or len(checksum) != 4:
+                raise ChunkError('Chunk %s too short for required %i octets.'
+                  % (type, length))
+            (checksum, ) = struct.unpack('!I', checksum)
+            if checksum != self._crc(type, data):
+                bad.append((type, offset + 8))
+            offset += 12 + length
+            if type == 'IEND':
+                break
+        return bad
+
+    def _checksum_error(self, type, checksum, verify, lenient):
+        """Report a chunk whose stored `checksum` differs from the
+        computed `verify`; a warning if `lenient`, otherwise an error.
+        """
+
+        message = "Checksum error in %s chunk: 0x%08X != 0x%08X." % (
+          type, checksum, verify)
+        if lenient:
+            warnings.warn(message, RuntimeWarning)
+        else:
+            raise ChunkError(message)
+
+    def chunk_index(self):
+        """Return a list of (*type*, *offset*, *length*) triples, one for
+        each chunk of a memory mapped file (see the `mmap` argument of
+        the constructor), where *offset* is the file offset of the
+        chunk's data.  Only the chunk headers are read to build the
+        index; chunk data is neither copied nor checksummed.  The index
+        is built once and then cached.
+        """
+
+        if self.index is not None:
+            return self.index
+        if not isinstance(self.file, _mapped):
+            raise Error("chunk_index needs a Reader created with mmap=")
+        buf = self.file.map
+        if buf[:8] != _signature:
+            raise FormatError("PNG file has invalid signature.")
+        index = []
+        offset = 8
+        while offset + 8 <= len(buf):
+            length, type = struct.unpack_from('!I4s', buf, offset)
+            type = bytestostr(type)
+            if offset + 12 + length > len(buf):
+                raise ChunkError('Chunk %s too short for required %i octets.'
+                  % (type, length))
+            index.append((type, offset + 8, length))
+            offset += 12 + length
+            if type == 'IEND':
+                break
+        self.index = index
+        return index
+
     def chunks(self):
         """Return an iterator that will yield each chunk as a
         (*chunktype*, *content*) pair.
@@ -1557,11 +2000,14 @@ class Reader:
         # Values per row (of the target image)
         vpr = self.width * self.planes
 
+        fmt = 'BH'[self.bitdepth > 8]
+        if numpy is not None:
+            return self._deinterlace_numpy(raw)
+
         # Make a result array, and make it big enough.  Interleaving
         # writes to the output array randomly (well, not quite), so the
         # entire output array must be in memory.
-        fmt = 'BH'[self.bitdepth > 8]
-        a = array(fmt, [0]*vpr*self.height)
+        a = array(fmt, [0]) * (vpr*self.height)
         source_offset = 0
 
         for xstart, ystart, xstep, ystep in _adam7:
@@ -1598,12 +2044,48 @@ class Reader:
                             flat[i::self.planes]
         return a
 
+    def _deinterlace_numpy(self, raw):
+        """Like :meth:`deinterlace` but each reduced pass is collected into
+        a single block and scattered into a ``numpy`` array with one
+        strided assignment.
+        """
+
+        fmt = 'BH'[self.bitdepth > 8]
+        dtype = (numpy.uint8, numpy.uint16)[self.bitdepth > 8]
+        out = numpy.zeros((self.height, self.width, self.planes), dtype)
+        source_offset = 0
+
+        for xstart, ystart, xstep, ystep in _adam7:
+            if xstart >= self.width or ystart >= self.height:
+                continue
+            recon = None
+            # Pixels per row (reduced pass image)
+            ppr = int(math.ceil((self.width-xstart)/float(xstep)))
+            # Row size in bytes for this pass.
+            row_size = int(math.ceil(self.psize * ppr))
+            block = array(fmt)
+            for y in range(ystart, self.height, ystep):
+                filter_type = raw[source_offset]
+                source_offset += 1
+                scanline = raw[source_offset:source_offset+row_size]
+                source_offset += row_size
+                recon = self.undo_filter(filter_type, scanline, recon)
+                block.extend(self.serialtoflat(recon, ppr))
+            block = numpy.frombuffer(block, dtype)
+            out[ystart::ystep, xstart::xstep] = \
+                block.reshape(-1, ppr, self.planes)
+        return array(fmt, out.tobytes())
+
     def iterboxed(self, rows):
         """Iterator that yields each scanline in boxed row flat pixel
         format.  `rows` should be an iterator that yields the bytes of
         each row in turn.
         """
 
+        if self.bitdepth < 8:
+            table = _unpack_table(self.bitdepth)
+        width = self.width
+
         def asvalues(raw):
             """Convert a row of raw bytes into a flat row.  Result may
             or may not share with argument"""
@@ -1611,17 +2093,9 @@ class Reader:
             if self.bitdepth == 8:
                 return raw
             if self.bitdepth == 16:
-                raw = tostring(raw)
-                return array('H', struct.unpack('!%dH' % (len(raw)//2), raw))
+                return _unpack16(raw)
             assert self.bitdepth < 8
-            width = self.width
-            # Samples per byte
-            spb = 8//self.bitdepth
-            out = array('B')
-            mask = 2**self.bitdepth - 1
-            shifts = list(map(self.bitdepth.__mul__, reversed(list(range(spb)))))
-            for o in raw:
-                out.extend([mask&(o>>i) for i in shifts])
+            out = array('B', strtobytes('').join(map(table.__getitem__, raw)))
             return out[:width]
 
         return map(asvalues, rows)
@@ -1634,24 +2108,25 @@ class Reader:
         if self.bitdepth == 8:
             return bytes
         if self.bitdepth == 16:
-            bytes = tostring(bytes)
-            return array('H',
-              struct.unpack('!%dH' % (len(bytes)//2), bytes))
+            return _unpack16(bytes)
         assert self.bitdepth < 8
         if width is None:
             width = self.width
         # Samples per byte
         spb = 8//self.bitdepth
-        out = array('B')
-        mask = 2**self.bitdepth - 1
-        shifts = list(map(self.bitdepth.__mul__, reversed(list(range(spb)))))
-        l = width
-        for o in bytes:
-            out.extend([(mask&(o>>s)) for s in shifts][:l])
-            l -= spb
-            if l <= 0:
-                l = width
-        return out
+        table = _unpack_table(self.bitdepth)
+        out = array('B', strtobytes('').join(map(table.__getitem__, bytes)))
+        # Each row is a whole number of bytes; drop the padding samples
+        # at the end of each row.
+        row_samples = -(-width // spb) * spb
+        if row_samples == width:
+            return out
+        if len(out) == row_samples:
+            return out[:width]
+        trimmed = array('B')
+        for i in range(0, len(out), row_samples):
+            trimmed.extend(out[i:i+width])
+        return trimmed
 
     def iterstraight(self, raw):
         """Iterator that undoes the effect of filtering, and yields each
@@ -1876,7 +2351,7 @@ class Reader:
             while True:
                 try:
                     type, data = self.chunk(lenient=lenient)
-                except ValueError(e):
+                except ValueError as e:
                     raise ChunkError(e.args[0])
                 if type == 'IEND':
                     # http://www.w3.org/TR/PNG/#11IEND
@@ -1889,25 +2364,59 @@ class Reader:
                     warnings.warn("PLTE chunk is required before IDAT chunk")
                 yield data
 
+        def itermapped():
+            """Like `iteridat`, but yields views of the ``IDAT`` chunk
+            data straight out of the memory map, without copying.  The
+            chunks from the first ``IDAT`` chunk on are checked, like
+            `iteridat` does; `preamble` has checked the ones before.
+            """
+            view = self.file.view
+            started = False
+            for type, offset, length in self.chunk_index():
+                if type != 'IDAT':
+                    if started:
+                        (checksum, ) = struct.unpack_from('!I', view,
+                                                          offset+length)
+                        self._check_crc(type, view[offset:offset+length],
+                                        checksum, lenient)
+                    continue
+                started = True
+                if self.colormap and not self.plte:
+                    warnings.warn("PLTE chunk is required before IDAT chunk")
+                data = view[offset:offset+length]
+                if self.crc != 'defer':
+                    (checksum, ) = struct.unpack_from('!I', view,
+                                                      offset+length)
+                    self._check_crc(type, data, checksum, lenient)
+                yield data
+
         def iterdecomp(idat):
             """Iterator that yields decompressed strings.  `idat` should
             be an iterator that yields the ``IDAT`` chunk data.
             """
 
-            # Currently, with no max_length paramter to decompress, this
-            # routine will do one yield per IDAT chunk.  So not very
-            # incremental.
+            # Output is produced at most 1 MiB at a time, so that a
+            # consumer that stops early (see read_region) stops the
+            # decompression too.
             d = zlib.decompressobj()
             # Each IDAT chunk is passed to the decompressor, then any
             # remaining state is decompressed out.
             for data in idat:
-                # :todo: add a max_length argument here to limit output
-                # size.
-                yield array('B', d.decompress(data))
+                while data:
+                    yield array('B', d.decompress(data, 2**20))
+                    data = d.unconsumed_tail
             yield array('B', d.flush())
 
         self.preamble(lenient=lenient)
-        raw = iterdecomp(iteridat())
+        if isinstance(self.file, _mapped):
+            raw = iterdecomp(itermapped())
+        else:
+            raw = iterdecomp(iteridat())
+
+        width, height = self.width, self.height
+        if self.region is not None:
+            y0, y1, x0, x1 = self._check_region()
+            width, height = x1 - x0, y1 - y0
 
         if self.interlace:
             raw = array('B', itertools.chain(*raw))
@@ -1916,19 +2425,80 @@ class Reader:
             # each row.
             pixels = map(lambda *row: array(arraycode, row),
                        *[iter(self.deinterlace(raw))]*self.width*self.planes)
+            if self.region is not None:
+                pixels = itertools.islice(pixels, y0, y1)
+                pixels = self._crop(pixels, x0*self.planes, x1*self.planes)
+        elif self.region is not None:
+            # Rows above the region still have to be defiltered (each
+            # row is filtered against the one before), but nothing after
+            # the region is decompressed, and only the columns in the
+            # region are unpacked.
+            rows = itertools.islice(self.iterstraight(raw), y0, y1)
+            if self.bitdepth >= 8:
+                rows = self._crop(rows, x0*self.psize, x1*self.psize)
+                pixels = self.iterboxed(rows)
+            else:
+                pixels = self.iterboxed(rows)
+                pixels = self._crop(pixels, x0, x1)
         else:
             pixels = self.iterboxed(self.iterstraight(raw))
+        if self.crc == 'defer':
+            # Also when a region read stops before the IEND chunk.
+            pixels = self._check_after(pixels, lenient)
         meta = dict()
         for attr in 'greyscale alpha planes bitdepth interlace'.split():
             meta[attr] = getattr(self, attr)
-        meta['size'] = (self.width, self.height)
+        meta['size'] = (width, height)
         for attr in 'gamma transparent background'.split():
             a = getattr(self, attr, None)
             if a is not None:
                 meta[attr] = a
         if self.plte:
             meta['palette'] = self.palette()
-        return self.width, self.height, pixels, meta
+        return width, height, pixels, meta
+
+    def read_region(self, y0, y1, x0=0, x1=None, lenient=False):
+        """
+        Read and decode only the rows `y0` to `y1` and the columns `x0`
+        to `x1` of the PNG file.  Like slices, the ranges start at 0 and
+        exclude their end; `x1` defaults to the image width.  Returns
+        (`width`, `height`, `pixels`, `metadata`) as per :meth:`read`,
+        but for the region.
+
+        For straightlaced images decoding stops after row `y1` and
+        columns outside the region are not unpacked.  Interlaced images
+        are decoded in full and then cropped.
+
+        The region is remembered, so that the other methods, such as
+        :meth:`asDirect` and :meth:`asRGBA`, can be called afterwards
+        and will also return the region only.  Equivalently, the
+        `region` attribute can be set to a (*y0*, *y1*, *x0*, *x1*)
+        tuple before calling any of them.
+        """
+
+        self.region = (y0, y1, x0, x1)
+        return self.read(lenient=lenient)
+
+    def _check_region(self):
+        """Return the region as a (*y0*, *y1*, *x0*, *x1*) tuple with
+        defaults filled in; raises ValueError if it is out of bounds.
+        """
+
+        y0, y1, x0, x1 = self.region
+        if y1 is None:
+            y1 = self.height
+        if x1 is None:
+            x1 = self.width
+        if not (0 <= y0 < y1 <= self.height and 0 <= x0 < x1 <= self.width):
+            raise ValueError("region %r does not fit in a %dx%d image" %
+              ((y0, y1, x0, x1), self.width, self.height))
+        return y0, y1, x0, x1
+
+    def _crop(self, rows, start, stop):
+        """Iterator that yields ``row[start:stop]`` for each row."""
+
+        for row in rows:
+            yield row[start:stop]
 
 
     def read_flat(self):
@@ -2551,6 +3121,109 @@ class Test(unittest.TestCase):
               interlace=True)
             x,y,pi,meta = Reader(bytes=pngs).read()
             self.assertEqual(list(map(list, ps)), list(map(list, pi)))
+    def testWriteBuffer(self):
+        """Test writing from a single packed buffer, with and without
+        row padding and interlacing."""
+        r = Reader(bytes=_pngsuite['basn2c08'])
+        x,y,pixels,meta = r.read_flat()
+        raw = tostring(pixels)
+        rowbytes = x*3
+        padded = strtobytes('').join(raw[i:i+rowbytes] + strtobytes('\0\1')
+          for i in range(0, len(raw), rowbytes))
+        for interlace in (False, True):
+            for buf,stride in ((raw, None), (memoryview(padded), rowbytes+2)):
+                w = Writer(x, y, interlace=interlace)
+                o = BytesIO()
+                w.write_buffer(o, buf, stride)
+                _,_,p,_ = Reader(bytes=o.getvalue()).read_flat()
+                self.assertEqual(p, pixels)
+        self.assertRaises(ValueError,
+          Writer(x, y).write_buffer, BytesIO(), raw[:-1])
+    def testParallelWrite(self):
+        """Test that compressing in several threads gives the same
+        pixels as compressing serially."""
+        rows = [[(x*y + x) & 0xff for x in range(3*97)] for y in range(61)]
+        serial = topngbytes('serial.png', rows, 97, 61)
+        parallel = topngbytes('parallel.png', rows, 97, 61,
+                              workers=4, chunk_limit=500)
+        for png in serial, parallel:
+            x,y,pixels,meta = Reader(bytes=png).read()
+            self.assertEqual(list(map(list, pixels)), rows)
+    def testMmap(self):
+        """Test reading a memory mapped file."""
+        import os
+
+        fd, name = tempfile.mkstemp('.png')
+        os.write(fd, _pngsuite['basn2c16'])
+        os.close(fd)
+        try:
+            bad = bytearray(_pngsuite['basn2c16'])
+            # Corrupt the checksum of the IEND chunk.
+            bad[-1] ^= 0xff
+            with open(name, 'wb') as f:
+                f.write(bytes(bad))
+            self.assertRaises(ChunkError,
+              lambda: list(Reader(mmap=name).read()[2]))
+            list(Reader(mmap=name, crc='skip').read()[2])
+            with open(name, 'wb') as f:
+                f.write(_pngsuite['basn2c16'])
+            with Reader(mmap=name) as r:
+                m = r.file.map
+                types = [type for type, offset, length in r.chunk_index()]
+                self.assertEqual(types[0], 'IHDR')
+                self.assertEqual(types[-1], 'IEND')
+                x,y,pixels,meta = r.read()
+                expected = Reader(bytes=_pngsuite['basn2c16']).read()[2]
+                self.assertEqual(list(map(list, pixels)),
+                                 list(map(list, expected)))
+            self.assertTrue(m.closed)
+        finally:
+            os.remove(name)
+    def testReadRegion(self):
+        """Test that read_region agrees with cropping the whole image,
+        for straightlaced and interlaced images."""
+        for name in ['basn2c08', 'basi2c08', 'basn0g01', 'basn0g16']:
+            full = Reader(bytes=_pngsuite[name]).read()[2]
+            planes = Reader(bytes=_pngsuite[name]).read()[3]['planes']
+            expected = [list(row[3*planes:17*planes])
+                        for row in list(full)[5:9]]
+            x,y,pixels,meta = Reader(bytes=_pngsuite[name]).read_region(
+              5, 9, 3, 17)
+            self.assertEqual((x, y), (14, 4))
+            self.assertEqual(list(map(list, pixels)), expected)
+        r = Reader(bytes=_pngsuite['basn2c08'])
+        self.assertRaises(ValueError, r.read_region, 0, 33)
+    def testCrcModes(self):
+        """Test the crc reader option and validate."""
+        import os
+
+        bad = bytearray(_pngsuite['basn0g08'])
+        # Corrupt the checksum of the first IDAT chunk.
+        i = bad.index(strtobytes('IDAT'))
+        length, = struct.unpack('!I', bytes(bad[i-4:i]))
+        bad[i+4+length] ^= 0xff
+        bad = bytes(bad)
+        self.assertRaises(ChunkError,
+          lambda: list(Reader(bytes=bad).read()[2]))
+        self.assertRaises(ChunkError,
+          lambda: list(Reader(bytes=bad, crc='defer').read()[2]))
+        # A region read stops before IEND, but still reports the error.
+        self.assertRaises(ChunkError, lambda: list(
+          Reader(bytes=bad, crc='defer').read_region(0, 1)[2]))
+        fd, name = tempfile.mkstemp('.png')
+        os.write(fd, bad)
+        os.close(fd)
+        try:
+            with Reader(mmap=name, crc='defer') as r:
+                self.assertRaises(ChunkError,
+                  lambda: list(r.read_region(0, 1)[2]))
+        finally:
+            os.remove(name)
+        self.assertRaises(ChunkError,
+          lambda: list(Reader(bytes=bad, crc='sample').read()[2]))
+        list(Reader(bytes=bad, crc='skip').read()[2])
+        self.assertEqual(Reader(bytes=bad).validate(), [('IDAT', i+4)])
+        self.assertEqual(Reader(bytes=_pngsuite['basn0g08']).validate(), [])
     def testPGMin(self):
         """Test that the command line tool can read PGM files."""
         def do():
@@ -3583,6 +4256,9 @@ def _main(argv):
     parser.add_option("-a", "--alpha",
                       action="store", type="string", metavar="pgmfile",
                       help="alpha channel transparency (RGBA)")
+    parser.add_option("-j", "--workers",
+                      action="store", type="int", metavar="n",
+                      help="compress in n threads")
     _add_common_options(parser)
 
     (options, args) = parser.parse_args(args=argv[1:])
@@ -3640,7 +4316,8 @@ def _main(argv):
                         background=options.background,
                         alpha=bool(pamalpha or options.alpha),
                         gamma=options.gamma,
-                        compression=options.compression)
+                        compression=options.compression,
+                        workers=options.workers)
         if options.alpha:
             pgmfile = open(options.alpha, 'rb')
             format, awidth, aheight, adepth, amaxval = \
@@ -3661,5 +4338,5 @@ def _main(argv):
 if __name__ == '__main__':
     try:
         _main(sys.argv)
-    except Error(e):
+    except Error as e:
         print(e)
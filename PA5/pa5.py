@@ -1,43 +1,143 @@
 from vec import Vec
+from operator import mul
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# Products with at least this many multiply-adds are handed to numpy's
+# matmul (BLAS); smaller ones are cheaper in plain Python.
+_BLAS_MIN_OPS = 4096
+
+
+def _dense(data):
+  """HELPER: numpy array of the flat entries, or None if they are not all plain numbers"""
+  if numpy is None:
+    return None
+  a = numpy.asarray(data)
+  if a.dtype.kind not in 'ifc':
+    return None
+  # Python ints outside int64 make numpy pick float64 for the whole array,
+  # which would round them: such entries stay in exact Python arithmetic
+  if a.dtype.kind != 'i' and any(type(e) is int and not -2**63 <= e < 2**63 for e in data):
+    return None
+  return a
+
+
+def _bound(a):
+  """HELPER: largest absolute value of an integer array, as a Python int"""
+  return max(-int(a.min()), int(a.max()))
+
+
+def _matmul(a, b, m, n, p):
+  """HELPER: flat row-major entries of the product of the m x n matrix a and
+  the n x p matrix b, both given as flat row-major lists"""
+  if m * n * p >= _BLAS_MIN_OPS:
+    da, db = _dense(a), _dense(b)
+    if da is not None and db is not None:
+      da, db = da.reshape(m, n), db.reshape(n, p)
+      if da.dtype.kind != 'i' or db.dtype.kind != 'i':
+        return (da @ db).ravel().tolist()
+      # Integer products stay exact in float64 below 2**53, and in int64
+      # below 2**63; beyond that Python ints are needed
+      bound = _bound(da) * _bound(db) * n
+      if bound < 2**53:
+        return (da.astype(float) @ db.astype(float)).astype(numpy.int64).ravel().tolist()
+      if bound < 2**63:
+        return (da @ db).ravel().tolist()
+  if p == 1:
+    # matrix-vector product: one fused dot product per row
+    return [sum(map(mul, a[i:i+n], b)) for i in range(0, m*n, n)]
+  rows = [a[i:i+n] for i in range(0, m*n, n)]
+  cols = [b[j::p] for j in range(p)]
+  return [sum(map(mul, row, col)) for row in rows for col in cols]
+
+
+def matvec_many(A, vs):
+  """
+  returns the list of products A * v for every Vec v in vs; the vectors
+  are stacked into the columns of one matrix, so there is a single
+  matrix product (one BLAS call for large inputs) instead of one per Vec
+  """
+  m, n = A._m, A._n
+  vs = list(vs)
+  if not vs:
+    return []
+  for v in vs:
+    if len(v.elements) != n:
+      raise ValueError
+  k = len(vs)
+  stacked = [e for row in zip(*[v.elements for v in vs]) for e in row]
+  product = _matmul(A._data, stacked, m, n, k)
+  return [Vec(product[j::k]) for j in range(k)]
 
 
 class Matrix:
 
   def __init__(self, rowsp):
-    self.rowsp = rowsp
-    self.colsp = self._construct_colsp(rowsp)
+    # The entries are stored once, row after row, in the flat list _data:
+    # row i is the slice _data[i*n:(i+1)*n] and column j the strided
+    # slice _data[j::n], so a row, column or entry can be replaced in
+    # place without rebuilding a transposed copy.
+    self._m = len(rowsp)
+    self._n = len(rowsp[0])
+    self._data = [e for row in rowsp for e in row]
+
+  @classmethod
+  def _from_data(cls, m, n, data):
+    """HELPER METHOD: builds an m x n Matrix directly on the flat list data"""
+    matrix = cls.__new__(cls)
+    matrix._m, matrix._n, matrix._data = m, n, data
+    return matrix
+
+  # rowsp and colsp (and so row_space, col_space, get_row and get_col)
+  # hand out fresh lists rather than views: callers such as eliminate
+  # modify the rows they get, and that must not write through to the
+  # Matrix.  Each call costs a copy, so code inside this package that
+  # only reads the entries works on _data directly.
+  @property
+  def rowsp(self):
+    return [self._data[i:i+self._n] for i in range(0, len(self._data), self._n)]
+
+  @property
+  def colsp(self):
+    return [self._data[j::self._n] for j in range(self._n)]
 
   def set_row(self, i, new_row):
-    if len(self.rowsp[0]) != len(new_row):
+    if self._n != len(new_row):
       raise ValueError("Incompatible row length.")
-    self.rowsp[i-1] = new_row
-    self.colsp = self._construct_colsp(self.row_space())
+    if not 1 <= i <= self._m:
+      raise IndexError
+    self._data[(i-1)*self._n:i*self._n] = new_row
 
   def set_col(self, j, new_col):
-    if len(self.colsp[0]) != len(new_col):
+    if self._m != len(new_col):
       raise ValueError("Incompatible column length.")
-    self.colsp[j-1] = new_col
-    self.rowsp = self._construct_rowsp(self.col_space())
+    if not 1 <= j <= self._n:
+      raise IndexError
+    self._data[j-1::self._n] = new_col
 
   def set_entry(self, i, j, val):
-    if not (1 <= i <= len(self.row_space())) or not (1 <= j <= len(self.col_space())):
+    if not (1 <= i <= self._m) or not (1 <= j <= self._n):
       raise IndexError
-    self.rowsp[i-1][j-1] = self.colsp[j-1][i-1] = val
+    self._data[(i-1)*self._n + j-1] = val
 
   def get_row(self, i):
-    if len(self.row_space()) < i:
+    if not 1 <= i <= self._m:
       raise IndexError
-    return self.rowsp[i-1]
+    return self._data[(i-1)*self._n:i*self._n]
   
   def get_col(self, j):
-    if len(self.col_space()) < j:
+    if not 1 <= j <= self._n:
       raise IndexError
-    return self.colsp[j-1]
+    return self._data[j-1::self._n]
   
   def get_entry(self, i, j):
-    if not (1 <= i <= len(self.row_space())) or not (1 <= j <= len(self.col_space())):
+    if not (1 <= i <= self._m) or not (1 <= j <= self._n):
       raise IndexError
-    return self.rowsp[i-1][j-1]
+    return self._data[(i-1)*self._n + j-1]
   
   def col_space(self):
     return self.colsp
@@ -46,55 +146,43 @@ class Matrix:
     return self.rowsp
   
   def get_diag(self, k):
-    r = []
-    i = 0
-    try:
-      while True:
-        r.append(self.rowsp[i][i+k] if k >= 0 else self.rowsp[i+abs(k)][i])
-        i += 1
-    except IndexError:
-      return r
-
-  def _construct_colsp(self, rowsp):
-    return [[rowsp[j][i] for j in range(len(rowsp))] for i in range(len(rowsp[0]))]
-
-  def _construct_rowsp(self, colsp):
-    return [[colsp[j][i] for j in range(len(colsp))] for i in range(len(colsp[0]))]
+    m, n = self._m, self._n
+    if k >= 0:
+      start, count = k, min(m, n - k)
+    else:
+      start, count = -k * n, min(m + k, n)
+    if count <= 0:
+      return []
+    return self._data[start:start + (count-1)*(n+1) + 1:n+1]
 
   def __add__(self, other):
-    if len(self.row_space()) != len(other.row_space()) or len(self.col_space()) != len(other.col_space()):
+    if self._m != other._m or self._n != other._n:
       raise ValueError
-    return Matrix([[self.rowsp[i][j] + other.rowsp[i][j] for j in range(len(other.rowsp[0]))] for i in range(len(other.rowsp))])
+    return Matrix._from_data(self._m, self._n, [a + b for a, b in zip(self._data, other._data)])
 
   def __sub__(self, other):
-    if len(self.row_space()) != len(other.row_space()) or len(self.col_space()) != len(other.col_space()):
+    if self._m != other._m or self._n != other._n:
       raise ValueError
-    return Matrix([[self.rowsp[i][j] - other.rowsp[i][j] for j in range(len(other.rowsp[0]))] for i in range(len(other.rowsp))])
+    return Matrix._from_data(self._m, self._n, [a - b for a, b in zip(self._data, other._data)])
 
   def __mul__(self, other):
     if type(other) == float or type(other) == int:
-      return Matrix([[n * other for n in row] for row in self.row_space()])
+      return Matrix._from_data(self._m, self._n, [n * other for n in self._data])
     elif type(other) == Matrix:
-      if len(self.col_space()) != len(other.row_space()):
+      if self._n != other._m:
         raise ValueError
-      r = []
-      for row in self.row_space():
-        r.append([[row[i] * col[i] for i in range(len(col))] for col in other.col_space()])
-      return Matrix([[sum(cur_row) for cur_row in row] for row in r])
+      return Matrix._from_data(self._m, other._n, _matmul(self._data, other._data, self._m, self._n, other._n))
     elif type(other) == Vec:
-      if len(self.col_space()) != len(other.elements):
+      if self._n != len(other.elements):
         raise ValueError
-      r = []
-      for row in self.row_space():
-        r.append([row[i] * other.elements[i] for i in range(len(other.elements))])
-      return Vec([sum(e) for e in r])
+      return Vec(_matmul(self._data, other.elements, self._m, self._n, 1))
     else:
       print("ERROR: Unsupported Type.")
     return
 
   def __rmul__(self, other):
     if type(other) == float or type(other) == int:
-      return Matrix([[n * other for n in row] for row in self.row_space()])
+      return Matrix._from_data(self._m, self._n, [n * other for n in self._data])
     else:
       print("ERROR: Unsupported Type.")
     return
@@ -111,11 +199,17 @@ class Matrix:
   def __eq__(self, other):
     """overloads the == operator to return True if 
       two Matrix objects have the same row space and column space"""
+    if type(other) == Matrix:
+      # same shape and same flat entries, without building row copies
+      return (self._m, self._n) == (other._m, other._n) and self._data == other._data
     return self.row_space() == other.row_space() and self.col_space(
     ) == other.col_space()
 
   def __req__(self, other):
     """overloads the == operator to return True if 
       two Matrix objects have the same row space and column space"""
+    if type(other) == Matrix:
+      # same shape and same flat entries, without building row copies
+      return (self._m, self._n) == (other._m, other._n) and self._data == other._data
     return self.row_space() == other.row_space() and self.col_space(
     ) == other.col_space()
\ No newline at end of file
@@ -1,5 +1,4 @@
-import copy
-from structures import Matrix, Vec
+from structures import Matrix, Vec, eliminate
 """ ----------------- PROBLEM 1 ----------------- """
 
 
@@ -18,56 +17,80 @@ def norm( v : Vec, p : int):
 """ ----------------- PROBLEM 2 ----------------- """
 
 
-def _ref(A : Matrix):
+def _ref(A : Matrix, exact=False):
   """
     returns the Row Echelon Form of the Matrix A
     INPUT: Matrix A
+           exact - if True, the elimination is done in exact rational
+                   arithmetic and the entries of the result are Fractions
     OUTPUT: distinct Matrix object that is the
             Row-Echelon Form of A
     """
-  matrix = Matrix(copy.deepcopy(A.rowsp))
-  m, n = matrix.dim()
-  cc = 0
-  for row in range(m):
-    if cc >= n:
-      break
-    p = None
-    for r in range(row, m):
-      if matrix.rowsp[r][cc] != 0:
-        p = r
-        break
-    if p is not None:
-      matrix.rowsp[row], matrix.rowsp[p] = matrix.rowsp[p], matrix.rowsp[row]
-      pivot_value = matrix.rowsp[row][cc]
-      matrix.rowsp[row] = [entry / pivot_value for entry in matrix.rowsp[row]]
-      for r in range(row + 1, m):
-        factor = matrix.rowsp[r][cc]
-        matrix.rowsp[r] = [entry - factor * matrix.rowsp[row][i] for i, entry in enumerate(matrix.rowsp[r])]
-      cc += 1
-  return matrix
+  # The echelon form depends on the choice of pivots, so both modes take
+  # the first non-zero entry of each column, as done by hand; rank and
+  # gauss_solve, whose results do not depend on it, pivot for stability
+  rows, pivots, cols, swaps = eliminate(A, pivoting='none', exact=exact)
+  return Matrix(rows)
 
 
 """ ----------------- PROBLEM 3 ----------------- """
 
 
-def rank(A : Matrix):
+def _is_integer(A : Matrix):
+  """
+  returns True if every entry of Matrix A is an int
+  """
+  return all(type(e) == int for e in A._data)
+
+
+def _bareiss_rank(rows):
+  """
+  returns the rank of an integer matrix, given as a list of rows, by
+  Bareiss fraction-free elimination: each new entry is
+  (pivot * a - f * b) // previous pivot, a division that is always exact,
+  so the entries stay integers no larger than the minors of the matrix
+  """
+  m, n = len(rows), len(rows[0])
+  prev = 1
+  r = 0
+  for c in range(n):
+    if r == m:
+      break
+    p = next((i for i in range(r, m) if rows[i][c] != 0), None)
+    if p is None:
+      continue
+    rows[r], rows[p] = rows[p], rows[r]
+    pivot = rows[r][c]
+    for i in range(r + 1, m):
+      f = rows[i][c]
+      rows[i] = [(pivot * a - f * b) // prev for a, b in zip(rows[i], rows[r])]
+    prev = pivot
+    r += 1
+  return r
+
+
+def rank(A : Matrix, exact=False):
   """
   returns the rank of the given Matrix object
   as an integer
+  INPUT: Matrix A
+         exact - if True, the rank is computed exactly: by fraction-free
+                 elimination for integer matrices, with Fractions otherwise;
+                 if False (the default, as for _ref and gauss_solve), by
+                 eliminate with partial pivoting, taking entries within
+                 its tolerance of zero as zero
   """
-  matrix = _ref(A)
-  c = 0
-  for i in range(len(matrix.rowsp)):
-    matrix.set_row(i+1, [r if r > 0.1**8 else 0 for r in matrix.get_row(i+1)])
-    if any(matrix.get_row(i+1)):
-      c += 1
-  return c
+  if exact:
+    if _is_integer(A):
+      return _bareiss_rank(A.row_space())
+    return len(eliminate(A, pivoting='none', exact=True)[1])
+  return len(eliminate(A)[1])
 
 
 """ ----------------- PROBLEM 4 ----------------- """
 
 
-def gauss_solve(A : Matrix, b : Vec):
+def gauss_solve(A : Matrix, b : Vec, exact=False):
   """
   returns the solution to the system Ax = b 
   if the system has a solution.  If the system
@@ -77,23 +100,30 @@ def gauss_solve(A : Matrix, b : Vec):
   INPUT:
       A - a Matrix object
       b - a Vec object
+      exact - if True, the system is solved in exact rational arithmetic
+              and the solution entries are Fractions; if False (the
+              default, as for _ref and rank), in floating point
 
   OUTPUT:
       Vec object if the system has a unique solution
       None if the system has no solution
       int if the system has infinitely-many solutions
   """
-  r = []
-  for i in range(A.dim()[0]):
-    r.append(A.get_row(i+1) + [b.elements[i]])
-  ag = Matrix(r)
-
-  if rank(A) < rank(ag):
+  m, n = A.dim()
+  if len(b.elements) != m:
+    raise ValueError("Incompatible vector length.")
+  ag = Matrix([A.get_row(i+1) + [b.elements[i]] for i in range(m)])
+
+  # One reduction of [A|b] to RREF gives everything: a pivot in the
+  # last column means no solution, fewer than n pivots leave free
+  # variables, and otherwise the last column is the solution
+  rows, pivots, cols, swaps = eliminate(ag, pivoting='none' if exact else 'partial',
+                                        reduced=True, exact=exact)
+  if pivots and pivots[-1] == n:
     return None
-  elif rank(A) == rank(ag) == len(A.col_space()) - 1:
-    return Vec()
-  else:
-    return len(A.col_space()) - rank(A)
+  if len(pivots) < n:
+    return n - len(pivots)
+  return Vec([rows[i][n] for i in range(n)])
 
 
 """ ----------------- PROBLEM 5 ----------------- """
@@ -1,3 +1,15 @@
+import sys
+from bisect import bisect_left
+from fractions import Fraction
+from itertools import repeat
+from operator import add, mul
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
 class Vec:
 
   def __init__(self, contents=[]):
@@ -86,43 +98,137 @@ class Vec:
 
 
 
+# Products with at least this many multiply-adds are handed to numpy's
+# matmul (BLAS); smaller ones are cheaper in plain Python.
+_BLAS_MIN_OPS = 4096
+
+
+def _dense(data):
+  """HELPER: numpy array of the flat entries, or None if they are not all plain numbers"""
+  if numpy is None:
+    return None
+  a = numpy.asarray(data)
+  if a.dtype.kind not in 'ifc':
+    return None
+  # Python ints outside int64 make numpy pick float64 for the whole array,
+  # which would round them: such entries stay in exact Python arithmetic
+  if a.dtype.kind != 'i' and any(type(e) is int and not -2**63 <= e < 2**63 for e in data):
+    return None
+  return a
+
+
+def _bound(a):
+  """HELPER: largest absolute value of an integer array, as a Python int"""
+  return max(-int(a.min()), int(a.max()))
+
+
+def _matmul(a, b, m, n, p):
+  """HELPER: flat row-major entries of the product of the m x n matrix a and
+  the n x p matrix b, both given as flat row-major lists"""
+  if m * n * p >= _BLAS_MIN_OPS:
+    da, db = _dense(a), _dense(b)
+    if da is not None and db is not None:
+      da, db = da.reshape(m, n), db.reshape(n, p)
+      if da.dtype.kind != 'i' or db.dtype.kind != 'i':
+        return (da @ db).ravel().tolist()
+      # Integer products stay exact in float64 below 2**53, and in int64
+      # below 2**63; beyond that Python ints are needed
+      bound = _bound(da) * _bound(db) * n
+      if bound < 2**53:
+        return (da.astype(float) @ db.astype(float)).astype(numpy.int64).ravel().tolist()
+      if bound < 2**63:
+        return (da @ db).ravel().tolist()
+  if p == 1:
+    # matrix-vector product: one fused dot product per row
+    return [sum(map(mul, a[i:i+n], b)) for i in range(0, m*n, n)]
+  rows = [a[i:i+n] for i in range(0, m*n, n)]
+  cols = [b[j::p] for j in range(p)]
+  return [sum(map(mul, row, col)) for row in rows for col in cols]
+
+
+def matvec_many(A, vs):
+  """
+  returns the list of products A * v for every Vec v in vs; the vectors
+  are stacked into the columns of one matrix, so there is a single
+  matrix product (one BLAS call for large inputs) instead of one per Vec
+  """
+  m, n = A._m, A._n
+  vs = list(vs)
+  if not vs:
+    return []
+  for v in vs:
+    if len(v.elements) != n:
+      raise ValueError
+  k = len(vs)
+  stacked = [e for row in zip(*[v.elements for v in vs]) for e in row]
+  product = _matmul(A._data, stacked, m, n, k)
+  return [Vec(product[j::k]) for j in range(k)]
+
+
 class Matrix:
 
   def __init__(self, rowsp):
-    self.rowsp = rowsp
-    self.colsp = self._construct_colsp(rowsp)
+    # The entries are stored once, row after row, in the flat list _data:
+    # row i is the slice _data[i*n:(i+1)*n] and column j the strided
+    # slice _data[j::n], so a row, column or entry can be replaced in
+    # place without rebuilding a transposed copy.
+    self._m = len(rowsp)
+    self._n = len(rowsp[0])
+    self._data = [e for row in rowsp for e in row]
+
+  @classmethod
+  def _from_data(cls, m, n, data):
+    """HELPER METHOD: builds an m x n Matrix directly on the flat list data"""
+    matrix = cls.__new__(cls)
+    matrix._m, matrix._n, matrix._data = m, n, data
+    return matrix
+
+  # rowsp and colsp (and so row_space, col_space, get_row and get_col)
+  # hand out fresh lists rather than views: callers such as eliminate
+  # modify the rows they get, and that must not write through to the
+  # Matrix.  Each call costs a copy, so code inside this package that
+  # only reads the entries works on _data directly.
+  @property
+  def rowsp(self):
+    return [self._data[i:i+self._n] for i in range(0, len(self._data), self._n)]
+
+  @property
+  def colsp(self):
+    return [self._data[j::self._n] for j in range(self._n)]
 
   def set_row(self, i, new_row):
-    if len(self.rowsp[0]) != len(new_row):
+    if self._n != len(new_row):
       raise ValueError("Incompatible row length.")
-    self.rowsp[i-1] = new_row
-    self.colsp = self._construct_colsp(self.row_space())
+    if not 1 <= i <= self._m:
+      raise IndexError
+    self._data[(i-1)*self._n:i*self._n] = new_row
 
   def set_col(self, j, new_col):
-    if len(self.colsp[0]) != len(new_col):
+    if self._m != len(new_col):
       raise ValueError("Incompatible column length.")
-    self.colsp[j-1] = new_col
-    self.rowsp = self._construct_rowsp(self.col_space())
+    if not 1 <= j <= self._n:
+      raise IndexError
+    self._data[j-1::self._n] = new_col
 
   def set_entry(self, i, j, val):
-    if not (1 <= i <= len(self.row_space())) or not (1 <= j <= len(self.col_space())):
+    if not (1 <= i <= self._m) or not (1 <= j <= self._n):
       raise IndexError
-    self.rowsp[i-1][j-1] = self.colsp[j-1][i-1] = val
+    self._data[(i-1)*self._n + j-1] = val
 
   def get_row(self, i):
-    if len(self.row_space()) < i:
+    if not 1 <= i <= self._m:
       raise IndexError
-    return self.rowsp[i-1]
+    return self._data[(i-1)*self._n:i*self._n]
   
   def get_col(self, j):
-    if len(self.col_space()) < j:
+    if not 1 <= j <= self._n:
       raise IndexError
-    return self.colsp[j-1]
+    return self._data[j-1::self._n]
   
   def get_entry(self, i, j):
-    if not (1 <= i <= len(self.row_space())) or not (1 <= j <= len(self.col_space())):
+    if not (1 <= i <= self._m) or not (1 <= j <= self._n):
       raise IndexError
-    return self.rowsp[i-1][j-1]
+    return self._data[(i-1)*self._n + j-1]
   
   def col_space(self):
     return self.colsp
@@ -131,61 +237,55 @@ class Matrix:
     return self.rowsp
   
   def get_diag(self, k):
-    r = []
-    i = 0
-    try:
-      while True:
-        r.append(self.rowsp[i][i+k] if k >= 0 else self.rowsp[i+abs(k)][i])
-        i += 1
-    except IndexError:
-      return r
-
-  def _construct_colsp(self, rowsp):
-    return [[rowsp[j][i] for j in range(len(rowsp))] for i in range(len(rowsp[0]))]
-
-  def _construct_rowsp(self, colsp):
-    return [[colsp[j][i] for j in range(len(colsp))] for i in range(len(colsp[0]))]
+    m, n = self._m, self._n
+    if k >= 0:
+      start, count = k, min(m, n - k)
+    else:
+      start, count = -k * n, min(m + k, n)
+    if count <= 0:
+      return []
+    return self._data[start:start + (count-1)*(n+1) + 1:n+1]
 
   def __add__(self, other):
-    if len(self.row_space()) != len(other.row_space()) or len(self.col_space()) != len(other.col_space()):
+    if type(other) != Matrix:
+      return NotImplemented
+    if self._m != other._m or self._n != other._n:
       raise ValueError
-    return Matrix([[self.rowsp[i][j] + other.rowsp[i][j] for j in range(len(other.rowsp[0]))] for i in range(len(other.rowsp))])
+    return Matrix._from_data(self._m, self._n, [a + b for a, b in zip(self._data, other._data)])
 
   def __sub__(self, other):
-    if len(self.row_space()) != len(other.row_space()) or len(self.col_space()) != len(other.col_space()):
+    if type(other) != Matrix:
+      return NotImplemented
+    if self._m != other._m or self._n != other._n:
       raise ValueError
-    return Matrix([[self.rowsp[i][j] - other.rowsp[i][j] for j in range(len(other.rowsp[0]))] for i in range(len(other.rowsp))])
+    return Matrix._from_data(self._m, self._n, [a - b for a, b in zip(self._data, other._data)])
 
   def __mul__(self, other):
     if type(other) == float or type(other) == int:
-      return Matrix([[n * other for n in row] for row in self.row_space()])
+      return Matrix._from_data(self._m, self._n, [n * other for n in self._data])
     elif type(other) == Matrix:
-      if len(self.col_space()) != len(other.row_space()):
+      if self._n != other._m:
         raise ValueError
-      r = []
-      for row in self.row_space():
-        r.append([[row[i] * col[i] for i in range(len(col))] for col in other.col_space()])
-      return Matrix([[sum(cur_row) for cur_row in row] for row in r])
+      return Matrix._from_data(self._m, other._n, _matmul(self._data, other._data, self._m, self._n, other._n))
     elif type(other) == Vec:
-      if len(self.col_space()) != len(other.elements):
+      if self._n != len(other.elements):
         raise ValueError
-      r = []
-      for row in self.row_space():
-        r.append([row[i] * other.elements[i] for i in range(len(other.elements))])
-      return Vec([sum(e) for e in r])
+      return Vec(_matmul(self._data, other.elements, self._m, self._n, 1))
+    elif type(other) == SparseMatrix:
+      return NotImplemented
     else:
       print("ERROR: Unsupported Type.")
     return
 
   def __rmul__(self, other):
     if type(other) == float or type(other) == int:
-      return Matrix([[n * other for n in row] for row in self.row_space()])
+      return Matrix._from_data(self._m, self._n, [n * other for n in self._data])
     else:
       print("ERROR: Unsupported Type.")
     return
   
   def dim(self) -> tuple[int, int]:
-    return (len(self.row_space()), len(self.col_space()))
+    return (self._m, self._n)
 
   '''-------- ALL METHODS BELOW THIS LINE ARE FULLY IMPLEMENTED -------'''
 
@@ -199,12 +299,428 @@ class Matrix:
   def __eq__(self, other):
     """overloads the == operator to return True if 
       two Matrix objects have the same row space and column space"""
+    if type(other) == Matrix:
+      # same shape and same flat entries, without building row copies
+      return (self._m, self._n) == (other._m, other._n) and self._data == other._data
     return self.row_space() == other.row_space() and self.col_space(
     ) == other.col_space()
 
   def __req__(self, other):
     """overloads the == operator to return True if 
       two Matrix objects have the same row space and column space"""
+    if type(other) == Matrix:
+      # same shape and same flat entries, without building row copies
+      return (self._m, self._n) == (other._m, other._n) and self._data == other._data
     return self.row_space() == other.row_space() and self.col_space(
     ) == other.col_space()
-  
\ No newline at end of file
+  
+
+
+# Relative size below which eliminate() takes an entry to be rounding
+# error: plain machine epsilon is too tight for LU, where the rounding
+# left in a zero row can be a few dozen times that
+_ELIMINATION_EPS = 2**10 * sys.float_info.epsilon
+
+
+def eliminate(A, pivoting='partial', reduced=False, normalize=True, exact=False, tol=None):
+  """
+  Gaussian elimination of Matrix A, done on a working copy; A is not changed.
+  INPUT:
+      pivoting  - 'partial': in each column, the entry of largest absolute
+                  value at or below the current row;
+                  'complete': the entry of largest absolute value in the
+                  whole remaining submatrix, swapping columns as well;
+                  'none': the first non-zero entry, as in hand calculations
+      reduced   - if True, the result is in reduced row echelon form
+      normalize - if True, every pivot row is divided by its pivot, so the
+                  pivots are 1 (always done when reduced is True)
+      exact     - if True, the arithmetic is done with fractions.Fraction
+      tol       - entries with absolute value at most tol count as zero;
+                  by default max(m, n) * _ELIMINATION_EPS * (largest |entry|)
+                  when some entry is a float or complex, and 0 otherwise
+                  (int and Fraction entries are then eliminated exactly)
+  OUTPUT:
+      (rows, pivots, cols, swaps):
+      rows   - the echelon form as a list of rows
+      pivots - the column (position) of the pivot of each non-zero row, so
+               len(pivots) is the rank
+      cols   - cols[j] is the column of A that ended up in position j;
+               only complete pivoting reorders the columns
+      swaps  - the number of row and column swaps made
+  """
+  if pivoting not in ('partial', 'complete', 'none'):
+    raise ValueError(f"Unknown pivoting {pivoting!r}.")
+  normalize = normalize or reduced
+  m, n = A.dim()
+  if exact:
+    W = [[Fraction(e) for e in row] for row in A.row_space()]
+  else:
+    W = _dense(A._data)
+    if W is not None:
+      # float copy; the rank-1 updates below work on it in place
+      W = W.reshape(m, n).astype(complex if W.dtype.kind == 'c' else float)
+      if tol is None:
+        tol = max(m, n) * _ELIMINATION_EPS * float(abs(W).max())
+    elif any(type(e) in (float, complex) for e in A._data):
+      W = A.row_space()
+      if tol is None:
+        tol = max(m, n) * _ELIMINATION_EPS * max(abs(e) for e in A._data)
+    elif all(type(e) in (int, Fraction) for e in A._data):
+      # no rounding in the input: keep it out of the elimination as well
+      W = [[Fraction(e) for e in row] for row in A.row_space()]
+    else:
+      W = A.row_space()
+  if tol is None:
+    tol = 0
+  cols = list(range(n))
+  pivots = []
+  swaps = 0
+  vectorized = type(W) != list
+  r = 0
+  c = 0
+  while r < m and c < n:
+    # choose the pivot (p, q)
+    if pivoting == 'complete':
+      if vectorized:
+        sub = abs(W[r:, c:])
+        p, q = numpy.unravel_index(numpy.argmax(sub), sub.shape)
+        p, q = int(p) + r, int(q) + c
+      else:
+        p, q = max(((i, j) for i in range(r, m) for j in range(c, n)), key=lambda ij: abs(W[ij[0]][ij[1]]))
+      if abs(W[p][q]) <= tol:
+        break
+      if q != c:
+        if vectorized:
+          W[:, [c, q]] = W[:, [q, c]]
+        else:
+          for row in W:
+            row[c], row[q] = row[q], row[c]
+        cols[c], cols[q] = cols[q], cols[c]
+        swaps += 1
+    else:
+      if pivoting == 'partial':
+        if vectorized:
+          p = r + int(numpy.argmax(abs(W[r:, c])))
+        else:
+          p = max(range(r, m), key=lambda i: abs(W[i][c]))
+      else:
+        p = next((i for i in range(r, m) if abs(W[i][c]) > tol), r)
+      if abs(W[p][c]) <= tol:
+        # no pivot in this column: clear what is left of it
+        for i in range(r, m):
+          W[i][c] = 0 * W[i][c]
+        c += 1
+        continue
+    if p != r:
+      if vectorized:
+        W[[r, p]] = W[[p, r]]
+      else:
+        W[r], W[p] = W[p], W[r]
+      swaps += 1
+    if vectorized:
+      # rank-1 update of the rows below the pivot
+      W[r+1:, c:] -= numpy.outer(W[r+1:, c] / W[r, c], W[r, c:])
+      W[r+1:, c] = 0
+    else:
+      pivot_row = W[r]
+      for i in range(r + 1, m):
+        if W[i][c] != 0:
+          factor = W[i][c] / pivot_row[c]
+          W[i] = W[i][:c] + [0 * pivot_row[c]] + [a - factor * b for a, b in zip(W[i][c+1:], pivot_row[c+1:])]
+    pivots.append(c)
+    r += 1
+    c += 1
+  # rows without a pivot are zero up to rounding
+  if vectorized:
+    W[r:] = 0
+  else:
+    for i in range(r, m):
+      W[i] = [0 * e for e in W[i]]
+  # The pivot rows are scaled only now, so that the rounding left in the
+  # rows below stays on the scale of A that tol is relative to
+  if normalize:
+    for k, c in enumerate(pivots):
+      if vectorized:
+        W[k, c:] /= W[k, c]
+      else:
+        pivot = W[k][c]
+        W[k] = W[k][:c] + [pivot / pivot] + [e / pivot for e in W[k][c+1:]]
+  if reduced:
+    # clear the entries above each pivot, from the last pivot up
+    for k in reversed(range(len(pivots))):
+      c = pivots[k]
+      if vectorized:
+        W[:k, c:] -= numpy.outer(W[:k, c], W[k, c:])
+        W[:k, c] = 0
+      else:
+        for i in range(k):
+          if W[i][c] != 0:
+            factor = W[i][c]
+            W[i] = W[i][:c] + [0 * W[k][c]] + [a - factor * b for a, b in zip(W[i][c+1:], W[k][c+1:])]
+  return (W.tolist() if vectorized else W), pivots, cols, swaps
+
+
+class SparseMatrix:
+  """
+  m x n matrix that only stores its non-zero entries, in compressed
+  sparse row (CSR) form: the entries of row i are _values[_indptr[i]:
+  _indptr[i+1]], in columns _indices[_indptr[i]:_indptr[i+1]] (0-based,
+  increasing).  A compressed sparse column (CSC) copy is built the first
+  time a column is needed.  Rows, columns and entries are 1-based, as in
+  Matrix.
+  """
+
+  def __init__(self, m, n, entries=None):
+    """entries is an optional dict {(i, j): value} with 1-based indices;
+    zero values are not stored"""
+    rows = [[] for i in range(m)]
+    for (i, j), val in (entries or {}).items():
+      if not (1 <= i <= m) or not (1 <= j <= n):
+        raise IndexError
+      if val != 0:
+        rows[i-1].append((j-1, val))
+    self._m, self._n = m, n
+    self._indptr = [0]
+    self._indices = []
+    self._values = []
+    for row in rows:
+      row.sort()
+      self._indices.extend(j for j, val in row)
+      self._values.extend(val for j, val in row)
+      self._indptr.append(len(self._indices))
+    self._csc = None
+
+  @classmethod
+  def _from_csr(cls, m, n, indptr, indices, values):
+    """HELPER METHOD: builds an m x n SparseMatrix directly on CSR lists"""
+    matrix = cls.__new__(cls)
+    matrix._m, matrix._n = m, n
+    matrix._indptr, matrix._indices, matrix._values = indptr, indices, values
+    matrix._csc = None
+    return matrix
+
+  @classmethod
+  def from_matrix(cls, A):
+    """returns the SparseMatrix with the non-zero entries of Matrix A"""
+    m, n = A.dim()
+    indptr, indices, values = [0], [], []
+    for i in range(0, m*n, n):
+      for j, val in enumerate(A._data[i:i+n]):
+        if val != 0:
+          indices.append(j)
+          values.append(val)
+      indptr.append(len(indices))
+    return cls._from_csr(m, n, indptr, indices, values)
+
+  def to_matrix(self):
+    """returns the dense Matrix with the entries of this SparseMatrix"""
+    data = [0] * (self._m * self._n)
+    for i in range(self._m):
+      for k in range(self._indptr[i], self._indptr[i+1]):
+        data[i*self._n + self._indices[k]] = self._values[k]
+    return Matrix._from_data(self._m, self._n, data)
+
+  def _get_csc(self):
+    """HELPER METHOD: (colptr, rows, values) of the CSC copy, built on first use"""
+    if self._csc is None:
+      colptr = [0] * (self._n + 1)
+      for j in self._indices:
+        colptr[j+1] += 1
+      for j in range(self._n):
+        colptr[j+1] += colptr[j]
+      rows = [0] * len(self._indices)
+      values = [0] * len(self._values)
+      nxt = colptr[:-1]
+      for i in range(self._m):
+        for k in range(self._indptr[i], self._indptr[i+1]):
+          pos = nxt[self._indices[k]]
+          rows[pos] = i
+          values[pos] = self._values[k]
+          nxt[self._indices[k]] += 1
+      self._csc = (colptr, rows, values)
+    return self._csc
+
+  def dim(self) -> tuple[int, int]:
+    return (self._m, self._n)
+
+  def nnz(self):
+    """returns the number of stored (non-zero) entries"""
+    return len(self._values)
+
+  def get_row(self, i):
+    if not 1 <= i <= self._m:
+      raise IndexError
+    row = [0] * self._n
+    for k in range(self._indptr[i-1], self._indptr[i]):
+      row[self._indices[k]] = self._values[k]
+    return row
+
+  def get_col(self, j):
+    if not 1 <= j <= self._n:
+      raise IndexError
+    colptr, rows, values = self._get_csc()
+    col = [0] * self._m
+    for k in range(colptr[j-1], colptr[j]):
+      col[rows[k]] = values[k]
+    return col
+
+  def get_entry(self, i, j):
+    if not (1 <= i <= self._m) or not (1 <= j <= self._n):
+      raise IndexError
+    start, end = self._indptr[i-1], self._indptr[i]
+    k = bisect_left(self._indices, j-1, start, end)
+    if k < end and self._indices[k] == j-1:
+      return self._values[k]
+    return 0
+
+  def row_space(self):
+    """dense rows, as Matrix.row_space()"""
+    return [self.get_row(i) for i in range(1, self._m + 1)]
+
+  def col_space(self):
+    """dense columns, as Matrix.col_space()"""
+    return [self.get_col(j) for j in range(1, self._n + 1)]
+
+  def transpose(self):
+    # The CSC form of a matrix is the CSR form of its transpose
+    colptr, rows, values = self._get_csc()
+    return SparseMatrix._from_csr(self._n, self._m, colptr[:], rows[:], values[:])
+
+  def _merge(self, other, sign):
+    """HELPER METHOD: self + sign * other for a SparseMatrix other, row by row"""
+    indptr, indices, values = [0], [], []
+    for i in range(self._m):
+      row = dict(zip(self._indices[self._indptr[i]:self._indptr[i+1]],
+                     self._values[self._indptr[i]:self._indptr[i+1]]))
+      for k in range(other._indptr[i], other._indptr[i+1]):
+        j = other._indices[k]
+        row[j] = row.get(j, 0) + sign * other._values[k]
+      for j in sorted(row):
+        if row[j] != 0:
+          indices.append(j)
+          values.append(row[j])
+      indptr.append(len(indices))
+    return SparseMatrix._from_csr(self._m, self._n, indptr, indices, values)
+
+  def _add_dense(self, other, sign):
+    """HELPER METHOD: Matrix sign * other + self"""
+    data = [sign * e for e in other._data] if sign != 1 else other._data[:]
+    for i in range(self._m):
+      for k in range(self._indptr[i], self._indptr[i+1]):
+        data[i*self._n + self._indices[k]] += self._values[k]
+    return Matrix._from_data(self._m, self._n, data)
+
+  def __add__(self, other):
+    if type(other) != SparseMatrix and type(other) != Matrix:
+      return NotImplemented
+    if self.dim() != other.dim():
+      raise ValueError
+    if type(other) == Matrix:
+      return self._add_dense(other, 1)
+    return self._merge(other, 1)
+
+  def __radd__(self, other):
+    return self.__add__(other)
+
+  def __sub__(self, other):
+    if type(other) != SparseMatrix and type(other) != Matrix:
+      return NotImplemented
+    if self.dim() != other.dim():
+      raise ValueError
+    if type(other) == Matrix:
+      return self._add_dense(other, -1)
+    return self._merge(other, -1)
+
+  def __rsub__(self, other):
+    if type(other) != Matrix:
+      return NotImplemented
+    if self.dim() != other.dim():
+      raise ValueError
+    return (self * -1)._add_dense(other, 1)
+
+  def __mul__(self, other):
+    if type(other) == float or type(other) == int:
+      if other == 0:
+        return SparseMatrix(self._m, self._n)
+      return SparseMatrix._from_csr(self._m, self._n, self._indptr[:], self._indices[:],
+                                    [val * other for val in self._values])
+    elif type(other) == Vec:
+      if self._n != len(other.elements):
+        raise ValueError
+      x = other.elements.__getitem__
+      return Vec([sum(map(mul, self._values[self._indptr[i]:self._indptr[i+1]],
+                          map(x, self._indices[self._indptr[i]:self._indptr[i+1]])))
+                  for i in range(self._m)])
+    elif type(other) == SparseMatrix:
+      if self._n != other._m:
+        raise ValueError
+      # Row i of the product is the sum of the rows k of other scaled by
+      # the entries (i, k) of self
+      indptr, indices, values = [0], [], []
+      for i in range(self._m):
+        row = {}
+        for k in range(self._indptr[i], self._indptr[i+1]):
+          a, r = self._values[k], self._indices[k]
+          for t in range(other._indptr[r], other._indptr[r+1]):
+            j = other._indices[t]
+            row[j] = row.get(j, 0) + a * other._values[t]
+        for j in sorted(row):
+          if row[j] != 0:
+            indices.append(j)
+            values.append(row[j])
+        indptr.append(len(indices))
+      return SparseMatrix._from_csr(self._m, other._n, indptr, indices, values)
+    elif type(other) == Matrix:
+      if self._n != other._m:
+        raise ValueError
+      p = other._n
+      data = [0] * (self._m * p)
+      for i in range(self._m):
+        row = data[i*p:(i+1)*p]
+        for k in range(self._indptr[i], self._indptr[i+1]):
+          r = self._indices[k]
+          row = list(map(add, row, map(mul, repeat(self._values[k], p), other._data[r*p:(r+1)*p])))
+        data[i*p:(i+1)*p] = row
+      return Matrix._from_data(self._m, p, data)
+    else:
+      print("ERROR: Unsupported Type.")
+    return
+
+  def __rmul__(self, other):
+    if type(other) == float or type(other) == int:
+      return self * other
+    elif type(other) == Matrix:
+      # other * self, column by column: column j of the product is the
+      # sum of the columns i of other scaled by the entries (i, j) of self
+      if other._n != self._m:
+        raise ValueError
+      m, n = other._m, self._n
+      colptr, rows, values = self._get_csc()
+      data = [0] * (m * n)
+      for j in range(n):
+        col = [0] * m
+        for k in range(colptr[j], colptr[j+1]):
+          i = rows[k]
+          col = list(map(add, col, map(mul, repeat(values[k], m), other._data[i::other._n])))
+        data[j::n] = col
+      return Matrix._from_data(m, n, data)
+    else:
+      print("ERROR: Unsupported Type.")
+    return
+
+  def __str__(self):
+    """lists the non-zero entries with their 1-based positions"""
+    s = f"SparseMatrix {self._m}x{self._n}, {self.nnz()} non-zero entries\n"
+    for i in range(self._m):
+      for k in range(self._indptr[i], self._indptr[i+1]):
+        s += f"({i+1}, {self._indices[k]+1}): {self._values[k]}\n"
+    return s
+
+  def __eq__(self, other):
+    """True if other is a SparseMatrix or Matrix with the same entries"""
+    if type(other) == Matrix:
+      return self.dim() == other.dim() and self.to_matrix() == other
+    if type(other) != SparseMatrix:
+      return NotImplemented
+    return (self.dim() == other.dim() and self._indptr == other._indptr
+            and self._indices == other._indices and self._values == other._values)
@@ -1,5 +1,6 @@
-import copy
-from structures import Matrix, Vec
+from collections import OrderedDict
+import numpy as np
+from structures import Matrix, Vec, eliminate, _ELIMINATION_EPS
 
 
 def norm(v: Vec, p: int):
@@ -42,40 +43,202 @@ def _ref(A: Matrix):
     OUTPUT: distinct Matrix object that is the
             Row-Echelon Form of A
     """
-  matrix = Matrix(copy.deepcopy(A.rowsp))
-  m, n = matrix.dim()
+  # partial pivoting: the largest entry of each column is the pivot
+  rows, pivots, cols, swaps = eliminate(A)
+  return Matrix(rows)
 
-  # Iterate through each column
-  for j in range(min(m, n)):
-      # Find the first non-zero element in or below the current row
-      pivot_row = next((i for i in range(j, m) if matrix.rowsp[i][j] != 0), None)
 
-      if pivot_row is not None:
-          # Swap rows to move the pivot to the current row
-          matrix.rowsp[j], matrix.rowsp[pivot_row] = matrix.rowsp[pivot_row], matrix.rowsp[j]
+def rank(A: Matrix):
+  """
+  returns the rank of the given Matrix object
+  as an integer
+  """
+  # the number of pivots; entries within rounding of zero are not pivots
+  return len(eliminate(A)[1])
 
-          # Make the pivot element 1
-          pivot_value = matrix.rowsp[j][j]
-          for k in range(j, n):
-              matrix.rowsp[j][k] /= pivot_value
 
-          # Eliminate other elements in the current column
-          for i in range(j + 1, m):
-              factor = matrix.rowsp[i][j]
-              for k in range(j, n):
-                  matrix.rowsp[i][k] -= factor * matrix.rowsp[j][k]
+class LUFactor:
+  """
+  LU factorization with partial pivoting, P A = L U, of a square Matrix A.
+  The factorization costs O(n^3) once; every solve after that is a
+  forward and a back substitution, O(n^2) per right-hand side.
+  """
 
-  return matrix
+  def __init__(self, A: Matrix):
+    m, n = A.dim()
+    if m != n:
+      raise ValueError(f"LU factorization needs a square Matrix, not {m}x{n}.")
+    LU = np.array(A._data).reshape(m, n)
+    LU = LU.astype(complex if LU.dtype.kind == 'c' else float)
+    tol = n * _ELIMINATION_EPS * float(abs(LU).max())
+    perm = np.arange(n)
+    for k in range(n):
+      p = k + int(np.argmax(abs(LU[k:, k])))
+      if abs(LU[p, k]) <= tol:
+        raise ValueError("Matrix is singular.")
+      if p != k:
+        LU[[k, p]] = LU[[p, k]]
+        perm[[k, p]] = perm[[p, k]]
+      # L below the diagonal, U on and above it
+      LU[k+1:, k] /= LU[k, k]
+      LU[k+1:, k+1:] -= np.outer(LU[k+1:, k], LU[k, k+1:])
+    self.n = n
+    self.lu = LU
+    self.perm = perm
 
+  def _solve(self, B):
+    """HELPER METHOD: solves A X = B for an n x k array B"""
+    LU = self.lu
+    X = B[self.perm].astype(np.result_type(LU, B))
+    for i in range(self.n):
+      X[i] -= LU[i, :i] @ X[:i]
+    for i in reversed(range(self.n)):
+      X[i] = (X[i] - LU[i, i+1:] @ X[i+1:]) / LU[i, i]
+    return X
 
-def rank(A: Matrix):
+  def solve(self, b: Vec):
+    """returns the Vec x with A x = b"""
+    if len(b.elements) != self.n:
+      raise ValueError("Incompatible vector length.")
+    return Vec(self._solve(np.array(b.elements).reshape(self.n, 1))[:, 0].tolist())
+
+  def solve_many(self, B):
+    """
+    solves A x = b for every right-hand side at once; B is either a list
+    of Vecs, giving the list of solution Vecs, or a Matrix whose columns
+    are the right-hand sides, giving the Matrix of solution columns
+    """
+    return _solve_many(self, B)
+
+
+class QRFactor:
   """
-  returns the rank of the given Matrix object
-  as an integer
+  Householder QR factorization A = Q R of an m x n Matrix A (m >= n)
+  with linearly independent columns; R is n x n upper triangular.  Q is
+  kept implicitly as the n Householder reflectors, which is all solve()
+  needs; the property q builds the explicit m x n Q on request.  solve()
+  returns the least-squares solution, which is the exact solution when
+  A is square.
+  """
+
+  def __init__(self, A: Matrix):
+    m, n = A.dim()
+    if m < n:
+      raise ValueError(f"QR factorization needs at least as many rows as columns, not {m}x{n}.")
+    a = np.array(A._data).reshape(m, n)
+    a = a.astype(complex if a.dtype.kind == 'c' else float)
+    # Householder QR is backward stable, so only a column that is zero
+    # to working precision after the earlier reflections is dependent
+    tol = max(m, n) * np.finfo(float).eps * float(abs(a).max(initial=0))
+    reflectors = []
+    for k in range(n):
+      # H = I - 2 v v^H maps column k below the diagonal onto the
+      # diagonal; alpha takes the sign (phase) opposite to x[0] so that
+      # forming v never cancels
+      x = a[k:, k]
+      norm = np.linalg.norm(x)
+      if norm <= tol:
+        raise ValueError("The vectors are not linearly independent")
+      phase = x[0] / abs(x[0]) if x[0] != 0 else 1
+      v = x.copy()
+      v[0] += phase * norm
+      v /= np.linalg.norm(v)
+      a[k:, k:] -= 2 * np.outer(v, v.conj() @ a[k:, k:])
+      reflectors.append(v)
+    self.m, self.n = m, n
+    self.reflectors = reflectors
+    self.r = np.triu(a[:n])
+    self._q = None
+
+  def _apply_qh(self, B):
+    """HELPER METHOD: returns Q^H B for an m x k array B, as an m x k array"""
+    X = B.astype(np.result_type(self.r, B))
+    for k, v in enumerate(self.reflectors):
+      X[k:] -= 2 * np.outer(v, v.conj() @ X[k:])
+    return X
+
+  @property
+  def q(self):
+    """the explicit m x n Q with orthonormal columns, built on first use"""
+    if self._q is None:
+      Q = np.eye(self.m, self.n, dtype=self.r.dtype)
+      for k in reversed(range(self.n)):
+        v = self.reflectors[k]
+        Q[k:] -= 2 * np.outer(v, v.conj() @ Q[k:])
+      self._q = Q
+    return self._q
+
+  def _solve(self, B):
+    """HELPER METHOD: least-squares solution of A X = B for an m x k array B"""
+    R = self.r
+    X = self._apply_qh(B)[:self.n]
+    for i in reversed(range(self.n)):
+      X[i] = (X[i] - R[i, i+1:] @ X[i+1:]) / R[i, i]
+    return X
+
+  def solve(self, b: Vec):
+    """returns the Vec x that minimizes |A x - b|"""
+    if len(b.elements) != self.m:
+      raise ValueError("Incompatible vector length.")
+    return Vec(self._solve(np.array(b.elements).reshape(-1, 1))[:, 0].tolist())
+
+  def solve_many(self, B):
+    """
+    solves A x = b for every right-hand side at once; B is either a list
+    of Vecs, giving the list of solution Vecs, or a Matrix whose columns
+    are the right-hand sides, giving the Matrix of solution columns
+    """
+    return _solve_many(self, B)
+
+
+def _solve_many(factor, B):
+  """HELPER: solve_many of LUFactor and QRFactor"""
+  if type(B) == Matrix:
+    X = factor._solve(np.array(B._data).reshape(B.dim()))
+    return Matrix(X.tolist())
+  B = list(B)
+  if not B:
+    return []
+  X = factor._solve(np.array([b.elements for b in B]).T)
+  return [Vec(x) for x in X.T.tolist()]
+
+
+# Factorizations of recently used matrices, least recently used first
+_factors = OrderedDict()
+FACTOR_CACHE_SIZE = 16
+
+
+def factorize(A: Matrix, method='lu', cache=True):
+  """
+  returns a reusable factorization of Matrix A, with solve(b) and
+  solve_many(B) methods
+  INPUT:
+      A      - Matrix object
+      method - 'lu' for LUFactor (square A), 'qr' for QRFactor
+               (least squares for tall A)
+      cache  - if True, the factorizations of the last FACTOR_CACHE_SIZE
+               matrices are kept, keyed by their contents, so factorizing
+               the same matrix again costs one pass over its entries
+  OUTPUT:
+      LUFactor or QRFactor object
   """
-  mat = _ref(A)
-  rank = sum([1 for row in mat.rowsp if any(row)])
-  return rank
+  if method not in ('lu', 'qr'):
+    raise ValueError(f"Unknown factorization method {method!r}.")
+  make = LUFactor if method == 'lu' else QRFactor
+  if not cache:
+    return make(A)
+  # The entries themselves are the key: a Matrix changed after it was
+  # factorized can never pick up its old factorization
+  key = (method, A.dim(), tuple(A._data))
+  factor = _factors.get(key)
+  if factor is None:
+    factor = make(A)
+    _factors[key] = factor
+    if len(_factors) > FACTOR_CACHE_SIZE:
+      _factors.popitem(last=False)
+  else:
+    _factors.move_to_end(key)
+  return factor
 
 
 def frobenius_norm(A: Matrix):
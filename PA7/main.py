@@ -1,6 +1,6 @@
 import traceback
 from random import randint
-from structures import Vec, Matrix
+from structures import Vec, Matrix, matvec_many
 from helpers import norm, count, frobenius_norm
 import pa7
 import numpy as np
@@ -70,12 +70,12 @@ if __name__ == '__main__':
 
         passed = []
         i = 1
-        for val, vec in returned.items():
+        products = matvec_many(A, returned.values())
+        for (val, vec), Av in zip(returned.items(), products):
           print(
               "-" * 15 +
               f"\n{count[i]} eigenvalue \u03bb = {val}\n\n{count[i]} eigenvector v:\n{vec}"
           )
-          Av = A * vec
           lam_v = val * vec
           print("\nA * v:\n", Av)
           print("\n\u03bb * v:\n", lam_v)
@@ -1,5 +1,5 @@
-from helpers import gram_schmidt
-from structures import Vec, Matrix
+from helpers import factorize
+from structures import Vec, Matrix, matvec_many, eliminate
 import numpy as np
 import cmath
 
@@ -13,35 +13,9 @@ def qr_solve(A: Matrix, b: Vec):
     :param b: Vec of constants
     :return:  Vec solution to the system
     """
-  # Constructing U
-  # U should be the set of orthonormal vectors returned
-  # by applying Gram-Schmidt Process to the columns of A
-  U = gram_schmidt([Vec(c) for c in A.col_space()])
-  n = len(U)
-
-  # Constructing Q
-  # Q should be the matrix whose columns are the elements
-  # of the vector in set U
-  Q = Matrix([[None for j in range(n)] for i in range(n)])
-  for j in range(n):
-    [Q.set_entry(i+1, j+1, U[j][i]) for i in range(n)]
-
-  # Constructing R
-  R = Matrix([[0 for j in range(n)] for i in range(n)])
-  for j in range(n):
-    for i in range(n):
-      if i <= j:
-        R.set_entry(i+1, j+1, sum(U[i][k] * A.get_entry(k+1, j+1) for k in range(n)))
-
-  # Constructing the solution vector x
-  b_star = Q.transpose() * b
-  x = [None for i in range(n)]
-  for i in reversed(range(n)):
-    x[i] = b_star[i]
-    for j in range(i + 1, n):
-        x[i] -= R.get_entry(i + 1, j + 1) * x[j]
-    x[i] /= R.get_entry(i + 1, i + 1)
-  return Vec(x)
+  # The Householder factorization A = QR is cached, so solving again
+  # with the same A only costs applying Q^T to b and a back substitution
+  return factorize(A, 'qr').solve(b)
 
 
 # ----------------------- PROBLEM 2 ----------------------- #
@@ -76,12 +50,64 @@ def determinant(A: Matrix):
     return A.get_entry(1, 1)
   elif n == 2:
     return A.get_entry(1, 1) * A.get_entry(2, 2) - A.get_entry(1, 2) * A.get_entry(2, 1)
-  else:
+  elif n == 3:
     d = 0
     for i in range(1, n+1):
       sm = _submatrix(A, 1, i)
       d += (-1) ** (1+i) * A.get_entry(1, i) * determinant(sm)
     return d
+  # Cofactor expansion is O(n!); larger matrices are eliminated in O(n^3)
+  rows = A.row_space()
+  if all(type(e) == int for row in rows for e in row):
+    return _bareiss_det(rows)
+  a = np.asarray(rows)
+  if a.dtype.kind in 'fc':
+    # LAPACK LU factorization with partial pivoting
+    return np.linalg.det(a).item()
+  return _lu_det(A)
+
+
+def _bareiss_det(rows):
+  """
+    computes the determinant of a square integer matrix exactly with
+    Bareiss fraction-free elimination; every division is exact, so the
+    entries stay integers no larger than minors of the matrix
+    :param rows: list of rows; consumed
+    :return: int value of determinant
+    """
+  sign = 1
+  prev = 1
+  while len(rows) > 1:
+    p = next((i for i in range(len(rows)) if rows[i][0] != 0), None)
+    if p is None:
+      return 0
+    if p:
+      rows[0], rows[p] = rows[p], rows[0]
+      sign = -sign
+    pivot_row = rows[0]
+    pivot = pivot_row[0]
+    # each step drops the pivot row and column
+    rows = [[(pivot * a - row[0] * b) // prev for a, b in zip(row[1:], pivot_row[1:])]
+            for row in rows[1:]]
+    prev = pivot
+  return sign * rows[0][0]
+
+
+def _lu_det(A):
+  """
+    computes the determinant of a square matrix as the signed product of
+    the pivots of its elimination with partial pivoting; used for entries
+    numpy cannot factorize, such as Fractions
+    :param A: Matrix object
+    :return: value of determinant
+    """
+  rows, pivots, cols, swaps = eliminate(A, normalize=False)
+  if len(pivots) < len(rows):
+    return 0
+  d = (-1) ** swaps
+  for i in range(len(rows)):
+    d *= rows[i][i]
+  return d
 
 
 # ----------------------- PROBLEM 4 ----------------------- #
@@ -148,14 +174,15 @@ def svd(A: Matrix):
   # A * vj / sj where vj is the j-th eigenvector of A.transpose() * A
   # and sj is the corresponding j-th singular value
   U = Matrix([[None for j in range(m)] for i in range(m)])
+  # A * vj for every column vj of V that is used, in one product
+  Avs = matvec_many(A, [Vec(V.get_col(j)) for j in range(1, min(m, n) + 1)])
   for j in range(1, m + 1):
     if m > n and j > n:
       break
 
-    vj = Vec([V.get_entry(i, j) for i in range(1, n + 1)])
     sj = singular_values[j - 1]
     if sj != 0:
-      uj = (A * vj) / float(sj)
+      uj = Avs[j - 1] / float(sj)
       for i in range(m):
         U.set_entry(i + 1, j, uj[i])
     else: